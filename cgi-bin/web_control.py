@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import os
 import sys
 import cgi
 import zmq
@@ -10,12 +11,19 @@ cgitb.enable()
 
 
 def send_message(msg):
+    # Wait for the daemon to acknowledge the message, see utilities/comms_thread.py
     try:
         context = zmq.Context()
-        socket = context.socket(zmq.PAIR)
-        socket.setsockopt(zmq.LINGER, 2000)
+        socket = context.socket(zmq.DEALER)
+        socket.setsockopt(zmq.LINGER, 0)
         socket.connect("tcp://localhost:5555")
-        socket.send(msg)
+        request_id = str(os.getpid())
+        socket.send_multipart([request_id, msg])
+        if socket.poll(2000) == 0:
+            print "no reply"
+        elif socket.recv_multipart() != [request_id, "ACK"]:
+            print "not handled"
+        socket.close()
     except zmq.ZMQBaseError:
         print sys.exc_info()
 
@@ -7,6 +7,10 @@
 char temperature[64];
 char error[64];
 
+// Last published temperature, and when it was published
+char lastPublished[64];
+unsigned long lastPublishTime = 0;
+
 uint8_t sensors[80];
 
 //
@@ -116,6 +120,15 @@ void loop()
 //        }
         
         sprintf( temperature, "%3.3f", tempF );
+        
+        // Publish the temperature when it changes, and at least once a minute,
+        // so the server can follow the event stream instead of polling
+        if ( strcmp( temperature, lastPublished ) != 0 || millis() - lastPublishTime > 60000 )
+        {
+            Spark.publish( "temperature", temperature, 60, PRIVATE );
+            strcpy( lastPublished, temperature );
+            lastPublishTime = millis();
+        }
     }
     
     delay(10000);
@@ -23,7 +23,8 @@ class DeviceListenerPlugin(ThreadedPlugin):
         if not self.is_enabled():
             return
 
-        self._udp = UDPSocket(LISTEN_ADDR, LISTEN_PORT, LISTEN_PORT, PLUGIN_NAME + "_inf")
+        self._udp = UDPSocket(LISTEN_ADDR, LISTEN_PORT, LISTEN_PORT, PLUGIN_NAME + "_inf",
+                              event_loop=getattr(self.og, "event_loop", None))
         self._udp.start()
         
         self._devices = {}
@@ -67,6 +68,11 @@ class DeviceListenerPlugin(ThreadedPlugin):
                 
                 self._devices_lock.release()
         
+    def signal_stop(self):
+        ThreadedPlugin.signal_stop(self)
+        if self.is_initialized():
+            self._udp.interrupt()
+    
     def private_run_cleanup(self):
         self._udp.stop()
         
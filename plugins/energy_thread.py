@@ -89,7 +89,13 @@ class EnergyMonitorPlugin(ThreadedPlugin):
         
         self.packets = Queue.Queue()
         
-        self.data_logger = value_logger.ValueLogger(self.data_directory, "energy", "Electricity Used")
+        if "storage_format" not in config.options(PLUGIN_NAME):
+            self.storage_format = "csv"
+        else:
+            self.storage_format = config.get(PLUGIN_NAME, "storage_format", True)
+
+        self.data_logger = value_logger.ValueLogger(self.data_directory, "energy", "Electricity Used",
+                                                    storage_format=self.storage_format)
 
         def enqueue_output(out, queue):
             f = open("logs/rtlamr.log", 'w')
@@ -98,9 +104,15 @@ class EnergyMonitorPlugin(ThreadedPlugin):
                 f.write(line)
             f.close()
         
-        self.output_thread = Thread( target = enqueue_output, args = (self.amr_handle.stdout, self.packets) )
-        self.output_thread.daemon = True  # thread dies with the program
-        self.output_thread.start()
+        event_loop = getattr(self.og, "event_loop", None)
+        if event_loop is not None:
+            # Let the event loop read the output instead of a thread of its own
+            self.amr_log = open("logs/rtlamr.log", 'w')
+            event_loop.add_line_reader(self.amr_handle.stdout, self.enqueue_line)
+        else:
+            self.output_thread = Thread( target = enqueue_output, args = (self.amr_handle.stdout, self.packets) )
+            self.output_thread.daemon = True  # thread dies with the program
+            self.output_thread.start()
         
         time.sleep(5)
 
@@ -114,6 +126,14 @@ class EnergyMonitorPlugin(ThreadedPlugin):
         
         self._initialized = True
 
+    def enqueue_line(self, line):
+        if line is None:
+            self.amr_log.close()
+            return
+        self.packets.put(line.rstrip())
+        self.amr_log.write(line)
+        self.amr_log.flush()
+
     def private_run(self):
         if self.is_initialized():
             if self.rtl_handle.returncode is not None:
@@ -157,9 +177,7 @@ class EnergyMonitorPlugin(ThreadedPlugin):
                 except ValueError:
                     self.logger.debug( "Error parsing json" )
                             
-                for _ in range(1):
-                    if self._running:
-                        time.sleep(1)
+                self.wait(1)
 
     def private_run_cleanup(self):  
         if self.is_initialized():
@@ -179,6 +197,11 @@ class EnergyMonitorPlugin(ThreadedPlugin):
         config.set(PLUGIN_NAME, "rtl_ppm", "0")
         config.set(PLUGIN_NAME, "rtl_amr_exe", "/<path>/<to>/rtlamr")
         config.set(PLUGIN_NAME, "meter_serial_number", "5555555555")
+        config.set(PLUGIN_NAME, "storage_format", "csv")
+        
+    def get_version(self):
+        # The history chart is built from the data held by the logger
+        return self.data_logger.get_version()
         
     def get_html(self):
         if self.is_initialized():
@@ -207,13 +230,13 @@ class EnergyMonitorPlugin(ThreadedPlugin):
             
             function drawEnergyDataOnReady()
             {
-                $.get("%s", function (data) { drawEnergyData(data);  })
+                %s
             }
             
             ready_function_array.push( drawEnergyDataOnReady )
             
             """ % ( self.data_logger.get_google_linechart_javascript("Energy Usage", "today_energy_chart_div"),
-                    self.data_directory + "/today.csv" )
+                    self.data_logger.get_load_data_javascript("drawEnergyData") )
             
             #
             # Now generate a bar chart of the past days, only if data for past days exists
@@ -52,6 +52,7 @@ class FurnaceControlPlugin(ThreadedPlugin):
         # Get the device pins from the config file
         self.zones = self.og.thermostat_plugin.get_device_names()
         self.pins = {}
+        self.zones_that_are_heating = []
         for device in self.zones:
             pin_str = config_utils.get_config_param(config, PLUGIN_NAME, device, self.logger)
             if pin_str is None:
@@ -62,7 +63,8 @@ class FurnaceControlPlugin(ThreadedPlugin):
         self.furnace_controller = udp_interface.UDPSocket(address,
                                                           response_port,
                                                           command_port,
-                                                          PLUGIN_NAME + "_inf")
+                                                          PLUGIN_NAME + "_inf",
+                                                          event_loop=getattr(self.og, "event_loop", None))
         if not self.furnace_controller.is_initialized():
             self.logger.error( "Failed to initialize furnace_controller" )
             return
@@ -71,6 +73,8 @@ class FurnaceControlPlugin(ThreadedPlugin):
         # Setup data logger
         self.data_logger = presence_logger.PresenceLogger(data_directory, "furnace", self.zones)
 
+        self.set_period(60)
+
         self._initialized = True
 
     @staticmethod
@@ -143,16 +147,23 @@ class FurnaceControlPlugin(ThreadedPlugin):
                 
                 self.logger.info("Z: " + zone + " T: " + str(current_temperature) + " SP: " + str(set_p) + " " + s)
             
-            # Log the data
+            # Log the data, after the state the page shows since this changes the version
+            self.zones_that_are_heating = zones_that_are_heating
             self.data_logger.add_data( zones_that_are_heating )
+            self.publish_update( {"furnace_heating": self.get_heating_string(zones_that_are_heating)} )
         
         except Exception as e:
             tb = "".join( traceback.format_tb(sys.exc_info()[2]) )
             self.logger.error( "exception occurred in " + self.name + " thread: \n" + tb + "\n" + str( e ) )
-            
-        for _ in range(60):
-            if self.is_running():
-                time.sleep(1)
+
+    @staticmethod
+    def get_heating_string(zones_that_are_heating):
+        if len(zones_that_are_heating) == 0:
+            return "none"
+        return ", ".join(zones_that_are_heating)
+
+    def get_version(self):
+        return self.data_logger.get_version()
 
     def get_html(self):
         html = ""
@@ -163,13 +174,14 @@ class FurnaceControlPlugin(ThreadedPlugin):
             <div id="furnace" class="jumbotron">
                 <div class="row">
                     <h2>Furnace State:</h2>
+                    <p class="lead">Heating: <span id="furnace_heating">%s</span></p>
                     <div class="col-md-12">
                         <div id="furnace_chart_div"></div>
                     </div>
                 </div>
             </div>
             
-            """
+            """ % self.get_heating_string(self.zones_that_are_heating)
         
         return html
     
@@ -32,7 +32,15 @@ class MemoryMonitorPlugin(ThreadedPlugin):
         else:
             self.collect_period = float(config.get(PLUGIN_NAME, "collect_period", True))
         
-        self.data_logger = value_logger.ValueLogger(self.data_directory, "memory", "Percent Used")
+        if "storage_format" not in config.options(PLUGIN_NAME):
+            self.storage_format = "csv"
+        else:
+            self.storage_format = config.get(PLUGIN_NAME, "storage_format", True)
+        
+        self.data_logger = value_logger.ValueLogger(self.data_directory, "memory", "Percent Used",
+                                                    storage_format=self.storage_format)
+        
+        self.set_period(self.collect_period)
         
         self._initialized = True
     
@@ -41,6 +49,7 @@ class MemoryMonitorPlugin(ThreadedPlugin):
         config.add_section(PLUGIN_NAME)
         config.set(PLUGIN_NAME, "temp_data_dir", "data")
         config.set(PLUGIN_NAME, "data_directory", "%(temp_data_dir)s/memory_data")
+        config.set(PLUGIN_NAME, "storage_format", "csv")
         
     def private_run(self):
         
@@ -48,11 +57,11 @@ class MemoryMonitorPlugin(ThreadedPlugin):
         
         self.data_logger.add_data( [ str(percent_used) ] )
         self.logger.debug("Got:" + str(percent_used) )
-        
-        for _ in range(self.collect_period):
-            if self._running:
-                time.sleep(1)
   
+    def get_version(self):
+        # The chart data is fetched by the page
+        return self._version
+    
     def get_html(self):
         html = ""
         
@@ -83,13 +92,13 @@ class MemoryMonitorPlugin(ThreadedPlugin):
                 
                 function drawMemDataOnReady()
                 {
-                    $.get("%s", function (data) { drawMemData(data);  })
+                    %s
                 }
                 
                 ready_function_array.push( drawMemDataOnReady )
                 
                 """ % ( self.data_logger.get_google_linechart_javascript("Memory Usage", "mem_chart_div"), 
-                        self.data_directory + "/today.csv" )
+                        self.data_logger.get_load_data_javascript("drawMemData") )
             
         return jscript
     
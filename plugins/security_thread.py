@@ -153,7 +153,8 @@ class SecurityPlugin(ThreadedPlugin):
         self.data_logger = presence_logger.PresenceLogger(data_directory, "security", zone_names)
         
         # Setup UDP interface
-        self.udp = udp_interface.UDPSocket(address, port, port, PLUGIN_NAME + "_inf")
+        self.udp = udp_interface.UDPSocket(address, port, port, PLUGIN_NAME + "_inf",
+                                          event_loop=getattr(self.og, "event_loop", None))
         if not self.udp.is_initialized():
             return
         self.udp.start()
@@ -163,6 +164,7 @@ class SecurityPlugin(ThreadedPlugin):
                                             breach_number=self.breach_number)
         
         self.sensor_states = ""
+        self.published_state = None
         self._initialized = True
     
     @staticmethod
@@ -194,29 +196,45 @@ class SecurityPlugin(ThreadedPlugin):
         self.mutex.release()
         return ss
     
+    @staticmethod
+    def get_arm_button_class(arm_button_text):
+        if arm_button_text == "DISARMED":
+            return "btn-info"
+        if arm_button_text == "ARMED":
+            return "btn-success"
+        if arm_button_text == "TRIGGERED":
+            return "btn-warning"
+        return "btn-danger"
+
+    def publish_state(self):
+        """
+        Push the arm button and the sensor table to the open pages when they change
+        """
+        state = (self.security_state.get_state_string(), self.get_sensor_states())
+        if state == self.published_state:
+            return
+        self.published_state = state
+
+        self.publish_update( {"arm_btn": {"text": state[0], "class": self.get_arm_button_class(state[0])},
+                              "security_sensor_states": {"html": state[1]}} )
+
+    def get_version(self):
+        return self.security_state.get_state_string(), self.get_sensor_states(), self.data_logger.get_version()
+    
     def get_html(self):
         html = ""
         
         if self.is_initialized():
 
             arm_button_text = self.security_state.get_state_string()
-            arm_button_color = "btn-danger"
-
-            if arm_button_text == "DISARMED":
-                arm_button_color = "btn-info"
-            if arm_button_text == "ARMED":
-                arm_button_color = "btn-success"
-            if arm_button_text == "TRIGGERED":
-                arm_button_color = "btn-warning"
-            if arm_button_text == "ALARM":
-                arm_button_color = "btn-danger"
+            arm_button_color = self.get_arm_button_class(arm_button_text)
 
             html = """
                 <div id="security" class="jumbotron">
                     <div class="row">
                         <div class="col-md-12">
                             <h2>Security:</h2>
-                            <button name="arm_btn" type="button" class="%s" onclick="armSystem()">%s</button>
+                            <button id="arm_btn" name="arm_btn" type="button" class="%s" onclick="armSystem()">%s</button>
                             <table class="table table-condensed">
                                 <thead>
                                     <tr>
@@ -225,7 +243,7 @@ class SecurityPlugin(ThreadedPlugin):
                                         <th>Last Change</th>
                                     </tr>
                                 </thead>
-                                <tbody>
+                                <tbody id="security_sensor_states">
                                     %s               <!-- SECURITY STATE -->
                                 </tbody>
                             </table>
@@ -270,7 +288,7 @@ class SecurityPlugin(ThreadedPlugin):
                         command = "arm"
                     }
 
-                    $.get("cgi-bin/web_control.py?set_alarm="+command, function (result)
+                    $.get(allspark_server + "/control?set_alarm="+command, function (result)
                     {
                         var btn = $("button[name='arm_btn']")
 
@@ -391,6 +409,13 @@ class SecurityPlugin(ThreadedPlugin):
 
             self.mutex.release()
 
+        self.publish_state()
+
+    def signal_stop(self):
+        ThreadedPlugin.signal_stop(self)
+        if self.is_initialized():
+            self.udp.interrupt()
+    
     def private_run_cleanup(self):        
         self.udp.stop()
         
@@ -183,7 +183,7 @@ class SetPointPlugin(Plugin):
                 <div class="row">
                     <div class="col-md-2">
                         <h2>%s Floor</h2>          <!-- FLOOR NAME -->
-                        <p>Current: %.1f</p>       <!-- TOP CURRENT TEMP -->
+                        <p id="%s_current">Current: %.1f</p>       <!-- TOP CURRENT TEMP -->
                     </div>
                     <div class="col-md-5">
                         <h2></h2>
@@ -212,6 +212,7 @@ class SetPointPlugin(Plugin):
                 </div>
 
                 """ % ( zone_name_upper,
+                        zone,
                         self.og.thermostat_plugin.get_current_device_temp( zone ),
                         zone,
                         self.get_set_point( zone ),
@@ -232,7 +233,7 @@ class SetPointPlugin(Plugin):
         {
             var set_point = $("input[name='"+device+"']").val()
 
-            $.get("cgi-bin/web_control.py?set_temp="+set_point+"&floor="+device, function (result)
+            $.get(allspark_server + "/control?set_temp="+set_point+"&floor="+device, function (result)
             {
                 if (result.trim() == "OK")
                 {
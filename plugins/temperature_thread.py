@@ -1,5 +1,4 @@
 import os
-import time
 import logging
 from threading import Lock
 from utilities.thread_base import ThreadedPlugin
@@ -19,6 +18,9 @@ from utilities.data_logging import value_logger
 
 PLUGIN_NAME = "thermostat_plugin"
 
+# Span of the second chart, served from a rollup tier by /data
+WEEK_CHART_SPAN = 7 * 86400
+
 logger = logging.getLogger('allspark.' + PLUGIN_NAME)
 
 
@@ -52,7 +54,15 @@ class TemperatureMonitorPlugin(ThreadedPlugin):
         if not os.path.exists(self.data_directory):
             os.makedirs(self.data_directory)
 
-        self.data_logger = value_logger.ValueLogger(self.data_directory, "temperatures", self.device_names)
+        if "storage_format" not in config.options(PLUGIN_NAME):
+            self.storage_format = "csv"
+        else:
+            self.storage_format = config.get(PLUGIN_NAME, "storage_format", True)
+        
+        self.data_logger = value_logger.ValueLogger(self.data_directory, "temperatures", self.device_names,
+                                                    storage_format=self.storage_format)
+        
+        self.set_period(120)
         
         self._initialized = True
 
@@ -62,6 +72,7 @@ class TemperatureMonitorPlugin(ThreadedPlugin):
         config.set(PLUGIN_NAME, "data_directory", "data")
         config.set(PLUGIN_NAME, "temp_data_dir", "%(data_directory)s/temperature_data")
         config.set(PLUGIN_NAME, "data_file", "%(temp_data_dir)s/today.csv")
+        config.set(PLUGIN_NAME, "storage_format", "csv")
     
     def get_device_names(self):
         if not self._initialized:
@@ -83,9 +94,17 @@ class TemperatureMonitorPlugin(ThreadedPlugin):
         temps = []
         x = 0.0
         count = 0
-        for device in self.device_names:
-          
-            device_temp = self.og.spark.get_variable(device, "temperature")
+        # Use the values streamed by the devices, only poll the ones that have not sent anything recently
+        device_temps = [ self.og.spark.get_cached_variable(device, "temperature") for device in self.device_names ]
+        stale_devices = [ device for device, t in zip(self.device_names, device_temps) if t is None ]
+
+        if len(stale_devices) > 0:
+            # Read all of the stale devices at once so the samples line up in time
+            polled_temps = self.og.spark.get_variables([ (device, "temperature") for device in stale_devices ])
+            polled = dict(zip(stale_devices, polled_temps))
+            device_temps = [ polled.get(device, t) for device, t in zip(self.device_names, device_temps) ]
+
+        for device, device_temp in zip(self.device_names, device_temps):
 
             try:
                 x += float(device_temp)
@@ -105,19 +124,33 @@ class TemperatureMonitorPlugin(ThreadedPlugin):
                 temps.append( device_temp )
       
         if count > 0:
+            # The page shows the average to one decimal place
+            changed = "%.1f" % (x / count) != "%.1f" % self.current_average_temperature
             self.current_average_temperature = x / count
-        
+            if changed:
+                self.bump_version()
+
+        # Live values for the open pages, the set point panel shows each device
+        updates = { "average_temperature": "%.1f" % self.current_average_temperature }
+        for device in self.device_names:
+            updates[device + "_current"] = "Current: %.1f" % self.get_current_device_temp(device)
+        self.publish_update( updates )
+
         # Store the data
         self.data_logger.add_data( temps )
-        
-        for _ in range(120):
-            if self._running:
-                time.sleep(1)
   
     def get_average_temp(self):
         return self.current_average_temperature
     
     def get_current_device_temp(self, device):
+        # Prefer the latest value streamed by the device over the last sample
+        streamed_temp = self.og.spark.get_cached_variable(device, "temperature")
+        if streamed_temp is not None:
+            try:
+                return float(streamed_temp)
+            except ValueError:
+                pass
+
         if device in self.current_temps:
             if self.current_temps[device] is None:
                 return -1000.0
@@ -126,6 +159,9 @@ class TemperatureMonitorPlugin(ThreadedPlugin):
         logger.error( "WARNING:", device, "not found" )
         return -1000.0
     
+    def get_version(self):
+        return self._version
+    
     def get_html(self):
         html = ""
         
@@ -134,12 +170,17 @@ class TemperatureMonitorPlugin(ThreadedPlugin):
             
             <div id="plot" class="jumbotron">
                 <h2>Plot</h2>
-                <p class="lead">Current average temperature: %.1f F</p>          <!-- CURR AVERAGE TEMP -->
+                <p class="lead">Current average temperature: <span id="average_temperature">%.1f</span> F</p>          <!-- CURR AVERAGE TEMP -->
                 <div class="row">
                     <div class="col-md-12">
                         <div id="temp_chart_div" style="height: 500px;"></div>
                     </div>
                 </div>
+                <div class="row">
+                    <div class="col-md-12">
+                        <div id="temp_week_chart_div" style="height: 500px;"></div>
+                    </div>
+                </div>
             </div>
     
             """ % self.get_average_temp()
@@ -159,11 +200,25 @@ class TemperatureMonitorPlugin(ThreadedPlugin):
                 
                 function drawTempDataOnReady()
                 {
-                    $.get("%s", function (data) { drawTempData(data);  })           //   TEMPERATURE DATA FILENAME
+                    %s
                 }
                 ready_function_array.push( drawTempDataOnReady )
+                
+                function drawTempWeekData(data)
+                {
+                    %s
+                }
+                
+                function drawTempWeekDataOnReady()
+                {
+                    %s
+                }
+                ready_function_array.push( drawTempWeekDataOnReady )
             
             """ % ( self.data_logger.get_google_linechart_javascript("Zone Temperatures", "temp_chart_div"), 
-                    self.data_directory + "/today.csv" )
+                    self.data_logger.get_load_data_javascript("drawTempData"),
+                    self.data_logger.get_google_linechart_javascript("Zone Temperatures, Last 7 Days",
+                                                                     "temp_week_chart_div"),
+                    self.data_logger.get_load_data_javascript("drawTempWeekData", WEEK_CHART_SPAN) )
             
         return jscript
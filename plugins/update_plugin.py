@@ -31,6 +31,8 @@ class UpdateThreadPlugin(ThreadedPlugin):
 
         self.latest = ""
 
+        self.set_period(self.check_every_seconds)
+
         self._initialized = True
 
     @staticmethod
@@ -99,10 +101,6 @@ class UpdateThreadPlugin(ThreadedPlugin):
         except requests.RequestException as re:
             print re
 
-        for _ in range(self.check_every_seconds):
-            if self._running:
-                time.sleep(1)
-
     def private_run_cleanup(self):
         pass
 
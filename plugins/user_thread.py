@@ -44,6 +44,8 @@ class UserMonitorPlugin(ThreadedPlugin):
         self.users_present = True
         
         self.data_logger = presence_logger.PresenceLogger(self.data_directory, "user_data", user_names)
+
+        self.set_period(10)
         
         self._initialized = True
     
@@ -93,12 +95,12 @@ class UserMonitorPlugin(ThreadedPlugin):
                 someone_is_home = True
         
         self.logger.info( "Someone is home: " + str(someone_is_home) )
+        changed = someone_is_home != self.users_present
         self.users_present = someone_is_home
+        if changed:
+            self.bump_version()
+        self.publish_update( {"someone_home": self.is_someone_present_string()} )
         self.data_logger.add_data( data )
-            
-        for _ in range(10):
-            if self._running:
-                time.sleep(1)
         
     def is_someone_present_string(self):
         if not self._initialized:
@@ -121,6 +123,9 @@ class UserMonitorPlugin(ThreadedPlugin):
         self.logger.warning( "unknown user: " + user )
         return False
     
+    def get_version(self):
+        return self._version, self.data_logger.get_version()
+    
     def get_html(self):
 
         html = ""
@@ -130,7 +135,7 @@ class UserMonitorPlugin(ThreadedPlugin):
                 <div id="whosehome" class="jumbotron">
                     <div class="row">
                         <div class="col-md-12">
-                            <h2>Someone is home: %s</h2>     <!-- SOMEONE IS HOME -->
+                            <h2>Someone is home: <span id="someone_home">%s</span></h2>     <!-- SOMEONE IS HOME -->
                             <div id="user_chart_div"></div>
                         </div>
                     </div>
@@ -17,6 +17,11 @@ class ZWaveControlPlugin(Plugin):
     def get_dependencies():
         return []
 
+    @staticmethod
+    def get_init_timeout():
+        # Waits up to 300 seconds for the network to wake up
+        return 330
+
     def __init__(self, object_group, config):
         Plugin.__init__(self, config=config, object_group=object_group, plugin_name=PLUGIN_NAME)
 
@@ -197,7 +202,7 @@ class ZWaveControlPlugin(Plugin):
                 {
                     var new_value = $("input[name='"+device+"']").val()
 
-                    $.get("cgi-bin/web_control.py?set_zwave="+new_value+"&device="+device, function (result)
+                    $.get(allspark_server + "/control?set_zwave="+new_value+"&device="+device, function (result)
                     {
                         if (result.trim() == "OK")
                         {
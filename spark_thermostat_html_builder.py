@@ -2,6 +2,8 @@
 
 import ConfigParser
 import datetime
+import hashlib
+import gzip
 import logging
 import logging.handlers
 import os
@@ -14,6 +16,7 @@ from utilities import config_utils
 from utilities import graphite_logging
 
 template_contents = None
+last_content_hash = None
 config_filename = "data/config.cfg"
 GENERAL_CONFIG_SEC = "general"
 
@@ -32,8 +35,9 @@ def write_template_config():
     print "Created example.cfg"
 
 
-def build_html_file(filename, obj_group):
+def build_html_file(filename, obj_group, gzip_output=False):
     global template_contents
+    global last_content_hash
     
     start = datetime.datetime.now()
     
@@ -50,17 +54,40 @@ def build_html_file(filename, obj_group):
     content = template_contents % ( obj_group.get_javascript(), obj_group.get_html() )
     logging.getLogger("allspark").debug("done filling template")
     
-    logging.getLogger("allspark").debug("writing HTML file")
-    remove_file(filename)
-    f = open(filename, "w+")
-    f.write(content)
-    f.close()
-    logging.getLogger("allspark").debug("done writing HTML file")
+    # Leave the file alone if nothing changed since it was written
+    content_hash = hashlib.md5(content).digest()
+    if content_hash != last_content_hash:
+        logging.getLogger("allspark").debug("writing HTML file")
+        
+        # The compressed copy goes first so it is never older than the page
+        if gzip_output:
+            write_file_atomically(filename + ".gz", content, compress=True)
+        write_file_atomically(filename, content)
+        
+        last_content_hash = content_hash
+        logging.getLogger("allspark").debug("done writing HTML file")
     
     end = datetime.datetime.now()
     graphite_logging.send_data("allspark.htmlBuildTime", (end - start).total_seconds() )
 
 
+def write_file_atomically(filename, content, compress=False):
+    """
+    Write to a temporary file next to filename and rename it over filename,
+    so readers see either the old file or the new one, never a partial file
+    """
+    temp_filename = filename + ".tmp"
+    
+    if compress:
+        f = gzip.GzipFile(temp_filename, "wb", 9, mtime=0)
+    else:
+        f = open(temp_filename, "wb")
+    f.write(content)
+    f.close()
+    
+    os.rename(temp_filename, filename)
+
+
 def remove_file(filename):
     try:
         os.remove(filename)
@@ -69,10 +96,12 @@ def remove_file(filename):
 
 
 def check_permissions(filename):
+    # Try out the temporary file the page is written to, the page itself stays up
     try:
-        remove_file(filename)
-        f = open(filename, "w+")
+        temp_filename = filename + ".tmp"
+        f = open(temp_filename, "w+")
         f.close()
+        remove_file(temp_filename)
     except (OSError, IOError):
         print "check_permissions() got error:", sys.exc_info(), " on file:", filename
         sys.exit(1)
@@ -135,6 +164,11 @@ if not os.path.exists(data_directory):
 
 check_permissions(html_filename)
 
+# Also write a compressed copy of the page, for web servers that can serve it as it is
+html_gzip = False
+if "html_gzip" in config.options(GENERAL_CONFIG_SEC):
+    html_gzip = config.get(GENERAL_CONFIG_SEC, "html_gzip").lower() == "true"
+
 if type(logging.getLevelName(log_level)) is str:
     print "WARNING: Invalid log level detected '" + log_level + "'. Using DEBUG log level."
     log_level = "DEBUG"
@@ -190,7 +224,7 @@ signal.signal(signal.SIGINT, receive_signal)
 ############################################################################
 
 while True:
-    build_html_file(html_filename, og)
+    build_html_file(html_filename, og, html_gzip)
     # os.system("/home/mlamonta/bin/blink1-tool -q --hsb=130,200,50")
     time.sleep(60)
     # os.system("/home/mlamonta/bin/blink1-tool -q --off")
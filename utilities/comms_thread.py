@@ -8,23 +8,42 @@ import logging
 
 logger = logging.getLogger('allspark.comms_thread')
 
+# Replies to a request
+ACK = "ACK"    # the message was passed to the registered callbacks
+NACK = "NACK"  # nobody is registered for the topic
+
+STOP_ADDRESS = "inproc://comms_thread_stop"
+
 
 class CommsThread(Thread):
+    """
+    Receives control messages on a ROUTER socket, any number of DEALER clients
+    can send at the same time. A client sends [request id, message] and gets
+    [request id, ACK or NACK] back once the message has been dispatched.
+    """
+
     def __init__(self, port):
         Thread.__init__(self, name="comms_thread")
         self._initialized = False
         self._run_lock = Lock()
         self.port = port
-        
+
         try:
             self.context = zmq.Context()
-            self.socket = self.context.socket(zmq.PAIR)
+            self.socket = self.context.socket(zmq.ROUTER)
             self.socket.bind("tcp://*:" + str(self.port))
+
+            # stop() wakes the thread through this pair instead of the network
+            self.stop_receiver = self.context.socket(zmq.PAIR)
+            self.stop_receiver.bind(STOP_ADDRESS)
+            self.stop_sender = self.context.socket(zmq.PAIR)
+            self.stop_sender.connect(STOP_ADDRESS)
         except zmq.ZMQBaseError:
             logger.error( "Failed to start comms thread: " + repr(sys.exc_info()) )
             return
-        
+
         self.callbacks = {}
+        self._dispatch_lock = Lock()
         self._running = False
         self._initialized = True
 
@@ -33,13 +52,9 @@ class CommsThread(Thread):
 
     def stop(self):
         if self._initialized and self._running:
-            
-            # Send a quit message to close the thread
-            context = zmq.Context()
-            sock = context.socket(zmq.PAIR)
-            sock.connect("tcp://localhost:" + str(self.port))
-            sock.send("quit")
-             
+
+            self.stop_sender.send("quit")
+
             self._initialized = False
             self._running = False
             self._run_lock.acquire()
@@ -50,65 +65,140 @@ class CommsThread(Thread):
         else:
             self.callbacks[topic].append(func)
 
+    def dispatch(self, msg):
+        """
+        Call the callbacks registered for the topic of a message, one message at a
+        time whether it came from the socket or the web server. Returns the number
+        of callbacks called.
+        """
+        # message format:  topic,something,something ...
+        topic = msg.split(',')[0]
+
+        self._dispatch_lock.acquire()
+        try:
+            functions = self.callbacks.get(topic, [])
+            for func in functions:
+                logger.debug( "calling: " + func.__name__ )
+                func(msg)
+            return len(functions)
+        finally:
+            self._dispatch_lock.release()
+
     def run(self):
-        
+
         logger.info( "Thread started" )
-        
+
         if not self._initialized:
             logger.error( "Started before _initialized, not _running" )
             return
-        
+
         f = open("logs/comms_log", "a")
 
+        poller = zmq.Poller()
+        poller.register(self.socket, zmq.POLLIN)
+        poller.register(self.stop_receiver, zmq.POLLIN)
+
         self._running = self._run_lock.acquire()
         while self._running:
-            
-            msg = self.socket.recv()
-            
+
+            events = dict(poller.poll())
+
+            if self.stop_receiver in events:
+                self.stop_receiver.recv()
+                break
+
+            # [client identity, request id, message], a client that sends only
+            # the message gets an empty request id back
+            frames = self.socket.recv_multipart()
+            identity = frames[0]
+            request_id = frames[1] if len(frames) > 2 else ""
+            msg = frames[-1]
+
             logger.info( "Thread executed" )
-        
-            f.write(str(time.time()) + " GOT: " + str(msg) + "\n")
+
+            f.write(str(time.time()) + " GOT: " + str(msg) + " ID: " + repr(request_id) + "\n")
             f.flush()
-            
-            if msg == "quit":
-                break
-            
-            # message format:  topic,something,something ...
-            topic = msg.split(',')[0]
-            if topic not in self.callbacks:
-                f.write('nobody is registered for topic: "' + topic + '"\n')
-                f.flush()
-                continue
-             
-            # call each registered callback
-            functions = self.callbacks[topic]
-            for func in functions:
-                f.write("calling: " + func.__name__ + "\n")
-                f.flush()
-                func(msg)
-             
+
+            try:
+                if self.dispatch(msg) == 0:
+                    f.write('nobody is registered for topic: "' + msg.split(',')[0] + '"\n')
+                    f.flush()
+                    reply = NACK
+                else:
+                    reply = ACK
+            except Exception as e:
+                logger.error( "Error handling message '" + msg + "': " + str(e) )
+                reply = NACK
+
+            self.socket.send_multipart( [identity, request_id, reply] )
+
         f.close()
-        
+
         logger.info( "Thread stopped" )
-        
+
         self._run_lock.release()
 
+
+def send_message(msg, port=5555, timeout=2000, context=None):
+    """
+    Send a message to a CommsThread and wait for its reply, returns ACK or NACK,
+    or None if there was no reply within timeout milliseconds
+    """
+    if context is None:
+        context = zmq.Context.instance()
+
+    sock = context.socket(zmq.DEALER)
+    sock.setsockopt(zmq.LINGER, 0)
+    sock.connect("tcp://localhost:" + str(port))
+    try:
+        request_id = "%x" % id(sock)
+        sock.send_multipart( [request_id, msg] )
+
+        if sock.poll(timeout) == 0:
+            return None
+        (reply_id, reply) = sock.recv_multipart()
+        if reply_id != request_id:
+            return None
+        return reply
+    finally:
+        sock.close()
+
 #
 # MAIN
 #
 if __name__ == "__main__":
-    
-    def send_test():
-        context = zmq.Context()
-        sock = context.socket(zmq.PAIR)
-        sock.connect("tcp://localhost:5555")
-        sock.send("test,1,2,3,4")
-    
+
+    #
+    # Load test: NUM_CLIENTS clients each send NUM_MESSAGES messages at the same
+    # time, every message must be delivered to the callback and acknowledged
+    #
+    NUM_CLIENTS = 50
+    NUM_MESSAGES = 20
+
+    received = []
+    acked = []
+
     def test_callback(msg):
-        print msg
-    
+        received.append(msg)
+
+    def client(client_id):
+        sock = zmq.Context.instance().socket(zmq.DEALER)
+        sock.setsockopt(zmq.LINGER, 0)
+        sock.connect("tcp://localhost:5555")
+
+        for n in range(NUM_MESSAGES):
+            sock.send_multipart( ["%d.%d" % (client_id, n), "test,%d,%d" % (client_id, n)] )
+
+        for _ in range(NUM_MESSAGES):
+            if sock.poll(5000) == 0:
+                break
+            (request_id, reply) = sock.recv_multipart()
+            if reply == ACK:
+                acked.append(request_id)
+        sock.close()
+
     comms = CommsThread(5555)
-    
+
     if not comms.is_initialized():
         print "Failed to initialize"
 
@@ -117,9 +207,21 @@ if __name__ == "__main__":
         comms.register_callback("test", test_callback)
         comms.start()
 
-        print "Listening for messages for 10 seconds..."
-        time.sleep(5)
-        send_test()
-        time.sleep(5)
+        start = time.time()
+        clients = [ Thread(target=client, args=(i,)) for i in range(NUM_CLIENTS) ]
+        for c in clients:
+            c.start()
+        for c in clients:
+            c.join()
+        elapsed = time.time() - start
+
+        expected = NUM_CLIENTS * NUM_MESSAGES
+        print "Sent: %d  Received: %d  Acknowledged: %d  in %.2f s" % (expected, len(received), len(acked), elapsed)
+        print "Unknown topic:", send_message("nobody_here,1")
 
         comms.stop()
+
+        if len(received) != expected or len(set(acked)) != expected:
+            print "FAILED: messages were dropped"
+            sys.exit(1)
+        print "OK"
@@ -0,0 +1,145 @@
+#! /usr/bin/env python
+
+import logging
+
+logger = logging.getLogger('allspark.control_handler')
+
+MIN_SET_POINT = 50
+MAX_SET_POINT = 80
+
+
+class ControlHandler:
+    """
+    The set_temp, set_alarm and set_zwave commands of cgi-bin/web_control.py,
+    served by the daemon's web server at /control. Commands are passed straight
+    to the callbacks registered with the comms thread, and the replies are the
+    same plain text the CGI script prints. get_floors returns the floors the
+    set point plugin will apply a set_temp to, it is called for every set_temp
+    so a floor is only accepted once something handles it.
+    """
+
+    def __init__(self, comms, get_floors):
+        self.comms = comms
+        self.get_floors = get_floors
+
+    def handle(self, request, params):
+        reply = self.run_command(params)
+
+        request.send_response(200)
+        request.send_header("Content-Type", "text/plain")
+        request.send_header("Content-Length", str(len(reply)))
+        request.send_header("Access-Control-Allow-Origin", "*")
+        request.end_headers()
+        request.wfile.write(reply)
+
+    def run_command(self, params):
+        #
+        # Furnace set point control
+        #
+        if 'set_temp' in params and 'floor' in params:
+            try:
+                set_point = float(params['set_temp'])
+            except ValueError:
+                return "bad temp"
+
+            floor = params['floor']
+            if set_point > MAX_SET_POINT:
+                return "set point too high"
+            elif set_point < MIN_SET_POINT:
+                return "set point too low"
+            elif floor not in (self.get_floors() or []):
+                return "invalid floor: " + floor
+
+            self.comms.dispatch("set_point,%s,%s" % (floor, str(set_point)))
+            return "OK"
+
+        #
+        # Security arm/disarm control
+        #
+        elif 'set_alarm' in params:
+            command = params['set_alarm']
+
+            if command == "arm":
+                self.comms.dispatch("alarm,arm")
+                return "ARMED"
+            elif command == "disarm":
+                self.comms.dispatch("alarm,disarm")
+                return "DISARMED"
+            return "INVALID"
+
+        #
+        # ZWave device control
+        #
+        elif 'set_zwave' in params and 'device' in params:
+            try:
+                value = int(params['set_zwave'])  # dimmer value 0-255 or 0/1 for switch
+            except ValueError:
+                return "Invalid value: " + params['set_zwave']
+
+            if value < 0 or value > 255:
+                return "Invalid value: " + str(value)
+
+            self.comms.dispatch("zwave,%s,%d" % (params['device'], value))
+            return "OK"
+
+        return "INVALID REQUEST"
+
+
+#
+# MAIN
+#
+if __name__ == "__main__":
+    import sys
+    import time
+    import httplib
+    import urlparse
+
+    #
+    # Benchmark: python control_handler.py [url of cgi-bin/web_control.py to compare with]
+    #
+    # Times alarm commands against an in-process server, and optionally against
+    # the CGI script behind a running web server. Sends "set_alarm=bogus" so
+    # nothing is armed or disarmed.
+    #
+    NUM_COMMANDS = 500
+
+    def benchmark(url, count):
+        parts = urlparse.urlparse(url)
+        connection = httplib.HTTPConnection(parts.hostname, parts.port or 80)
+        latencies = []
+        start = time.time()
+        for _ in range(count):
+            t = time.time()
+            connection.request("GET", parts.path + "?set_alarm=bogus")
+            connection.getresponse().read()
+            latencies.append(time.time() - t)
+        total = time.time() - start
+        connection.close()
+
+        latencies.sort()
+        print "%-60s %7.1f commands/s  mean %6.2f ms  p95 %6.2f ms" % \
+            (url, count / total, 1000 * total / count, 1000 * latencies[int(0.95 * count)])
+
+    class NullComms:
+        @staticmethod
+        def dispatch(msg):
+            return 0
+
+    import web_server
+
+    web = web_server.WebServer(8080)
+
+    if not web.is_initialized():
+        print "Failed to initialize"
+
+    else:
+        web.register_handler("/control", ControlHandler(NullComms(), lambda: []).handle)
+        web.start()
+
+        benchmark("http://localhost:8080/control", NUM_COMMANDS)
+
+        if len(sys.argv) > 1:
+            # Each CGI request starts a python process, a smaller sample is enough
+            benchmark(sys.argv[1], NUM_COMMANDS / 10)
+
+        web.stop()
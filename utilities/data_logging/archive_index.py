@@ -0,0 +1,141 @@
+
+import os
+import sys
+import json
+import bisect
+import logging
+from threading import Lock
+
+import storage
+
+logger = logging.getLogger('allspark.data_logger')
+
+# One offset is kept for every INDEX_STRIDE rows of a file
+INDEX_STRIDE = 64
+
+
+def index_file(data_storage, filepath, entry):
+    """
+    Add the rows past entry['size'] to an index entry, starting a new entry if
+    the file is new or has been rewritten since it was indexed. Returns the
+    entry and whether it changed.
+    """
+    size = os.path.getsize(filepath)
+
+    if entry is None or size < entry['size']:
+        entry = {'size': 0, 'rows': 0, 'start': None, 'end': None, 'offsets': []}
+    elif size == entry['size']:
+        return entry, False
+
+    for (timestamp, offset, next_offset) in data_storage.scan_file(filepath, entry['size']):
+        if entry['rows'] % INDEX_STRIDE == 0:
+            entry['offsets'].append( [timestamp, offset] )
+        if entry['start'] is None:
+            entry['start'] = timestamp
+        entry['end'] = timestamp
+        entry['rows'] += 1
+        entry['size'] = next_offset
+
+    return entry, True
+
+
+def find_offset(entry, start):
+    """
+    Offset of the last indexed row at or before start
+    """
+    times = [ t for (t, _) in entry['offsets'] ]
+    position = max(0, bisect.bisect_right(times, start) - 1)
+    return entry['offsets'][position][1]
+
+
+class ArchiveIndex:
+    """
+    Sidecar index over the daily archive files of one logger, saved as
+    "<prefix><extension>.index.json" in the data directory. For each file it keeps the
+    times of the first and last rows and the byte offset of every
+    INDEX_STRIDE'th row, so a time range is found with a few seeks instead of
+    parsing whole files. Files that grew since they were indexed (today's
+    file) are indexed from where the last scan stopped.
+
+    Only the newest file grows, its entry is kept in memory and only saved
+    along with a change to a closed day's entry or to the list of files (at
+    the day rollover), so finds do not keep rewriting the index.
+    """
+
+    def __init__(self, data_directory, archive_prefix, data_storage):
+        self.data_directory = data_directory
+        self.archive_prefix = archive_prefix
+        self.storage = data_storage
+        self.index_filename = os.path.join(data_directory, archive_prefix + data_storage.extension + ".index.json")
+        self.lock = Lock()
+        self.entries = self.load()
+
+    def load(self):
+        if not os.path.isfile(self.index_filename):
+            return {}
+
+        try:
+            f = open(self.index_filename, 'r')
+            entries = json.load(f)
+            f.close()
+            return entries
+        except (IOError, ValueError):
+            logger.warning( "Rebuilding unreadable index: " + self.index_filename )
+            return {}
+
+    def save(self):
+        temp_filename = self.index_filename + ".tmp"
+        try:
+            f = open(temp_filename, 'w')
+            json.dump(self.entries, f)
+            f.close()
+            os.rename(temp_filename, self.index_filename)
+        except (IOError, OSError):
+            logger.warning( "Could not write index: " + self.index_filename + " " + repr(sys.exc_info()[1]) )
+
+    def update(self):
+        changed = False
+        entries = {}
+
+        filepaths = storage.get_archive_files(self.data_directory, self.archive_prefix, self.storage)
+        for filepath in filepaths:
+            filename = os.path.basename(filepath)
+            entry, entry_changed = index_file(self.storage, filepath, self.entries.get(filename))
+            entries[filename] = entry
+            if entry_changed and filepath != filepaths[-1]:
+                changed = True
+
+        if changed or set(entries.keys()) != set(self.entries.keys()):
+            self.entries = entries
+            self.save()
+        else:
+            self.entries = entries
+
+    def forget(self, filepath):
+        """
+        Drop the entry of a file that was rewritten, it is indexed again by the next find
+        """
+        self.lock.acquire()
+        self.entries.pop(os.path.basename(filepath), None)
+        self.lock.release()
+
+    def find(self, start, end):
+        """
+        List of (filepath, offset) to read for the rows between start and end,
+        the offset is that of the last indexed row at or before start
+        """
+        self.lock.acquire()
+        try:
+            self.update()
+
+            result = []
+            for filename in sorted(self.entries.keys()):
+                entry = self.entries[filename]
+                if entry['start'] is None or entry['end'] < start or entry['start'] > end:
+                    continue
+
+                result.append( (os.path.join(self.data_directory, filename), find_offset(entry, start)) )
+
+            return result
+        finally:
+            self.lock.release()
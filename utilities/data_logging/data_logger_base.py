@@ -4,18 +4,56 @@ import time
 import datetime
 import logging
 from threading import Lock
+import storage
+import data_writer
+from archive_index import ArchiveIndex
+from day_series import DaySeries
 
 logger = logging.getLogger('allspark.data_logger')
 
 MAX_DAYS_OF_HISTORY = 7
 
+# Javascript Date strings are cached by whole second, the cache is emptied when it reaches this size
+MAX_TIME_STRING_CACHE = 50000
+
+_time_string_cache = {}
+
+
+def get_time_string(timestamp):
+    """
+    Javascript Date constructor for a timestamp, for example "new Date(2015,0,31,23,59,59)"
+    """
+    key = int(timestamp)
+    
+    time_str = _time_string_cache.get(key)
+    if time_str is None:
+        t = time.localtime(key)
+        # javascript expects month in 0-11, tm_mon is 1-12
+        time_str = 'new Date(%d,%d,%d,%d,%d,%d)' % (t.tm_year, t.tm_mon - 1, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec)
+        
+        if len(_time_string_cache) >= MAX_TIME_STRING_CACHE:
+            _time_string_cache.clear()
+        _time_string_cache[key] = time_str
+        
+    return time_str
+
 
 class DataLogger:
-    def __init__(self, data_directory, archive_prefix):
+    def __init__(self, data_directory, archive_prefix, data_storage=None):
         self._initialized = False
         self.mutex = Lock()
         self.archive_prefix = archive_prefix
-        self.filename = data_directory + "/today.csv"
+        
+        # Counts the samples added, see get_version
+        self._version = 0
+
+        # How the daily archive files are stored, plain CSV unless told otherwise
+        if data_storage is None:
+            data_storage = storage.CsvStorage()
+        self.storage = data_storage
+
+        self.filename = data_directory + "/today" + self.storage.extension
+        self.todays_filename = None
                 
         # Create the log directory if it does not exist
         self.data_directory = data_directory
@@ -24,10 +62,12 @@ class DataLogger:
         
         logger.debug("Data directory: " + self.data_directory)
         
+        self.archive_index = ArchiveIndex(self.data_directory, self.archive_prefix, self.storage)
+        
         self.last_day = time.localtime().tm_mday
         
         #
-        # 2-D array where D1 = days of data and D2 is an array of data items for that day
+        # List of DaySeries, one per day of data, indexing a DaySeries gives a data item
         #
         # data[0][0]  = first item in the oldest day of loaded history (up to MAX_DAYS_OF_HISTORY old)
         # data[-1][0] = first item in todays data
@@ -48,18 +88,34 @@ class DataLogger:
             logger.error( "setup_data_file called before _initialized." )
             return
         
-        today = datetime.date.today().strftime( self.archive_prefix + '_%Y_%m_%d.csv' )
+        today = self.get_todays_archive_name()
         todays_filename = self.data_directory + "/" + today
         
         # If the "today" link exists, delete it
         if os.path.islink(self.filename):
             os.unlink(self.filename)
         
-        # Touch todays data file (does nothing if it already exists)
-        open(todays_filename, 'a').close()
+        # Create todays data file, or bring the one from before a restart to the current format
+        if self.storage.create_file(todays_filename):
+            self.archive_index.forget(todays_filename)
         
         # Create the "today" link to todays data file
         os.symlink(today, self.filename)
+        
+        # Write to the file itself, a write-behind handle must not follow the link to the next day
+        self.todays_filename = todays_filename
+
+    def get_todays_archive_name(self):
+        return datetime.date.today().strftime( self.archive_prefix + '_%Y_%m_%d' + self.storage.extension )
+
+    def start_new_day(self):
+        """
+        Begin an empty day of history and forget the oldest one. The days
+        already in memory are kept as they are, nothing is read from disk.
+        """
+        self.data.append( DaySeries() )
+        if len(self.data) > MAX_DAYS_OF_HISTORY:
+            del self.data[0]
 
     def get_data_item(self, dataset = -1, index = -1):
         if self.is_initialized():
@@ -84,34 +140,63 @@ class DataLogger:
             return len(self.data)
         return 0
 
-    @staticmethod
-    def load_file(filepath):
-        data = []
+    def get_version(self):
+        """
+        Changes whenever data is added, for caching anything built from the data
+        """
+        return self._version
+
+    def data_added(self, timestamp, data):
+        """
+        Called with the logger mutex held after each sample is added, for subclasses to extend
+        """
+        pass
+
+    def get_column_names(self):
+        """
+        Names of the data items, for loggers that store a fixed set of columns
+        """
+        return []
+
+    def query(self, start, end, columns=None):
+        """
+        Get the (time, data) rows with start <= time <= end from the whole archive,
+        not only the days held in memory. columns optionally selects data items by
+        index or by name (see get_column_names).
+        """
+        if not self.is_initialized():
+            return []
+        
+        rows = list( self.iter_query(start, end) )
+        
+        if columns is not None:
+            names = self.get_column_names()
+            indexes = [ c if isinstance(c, int) else names.index(c) for c in columns ]
+            rows = [ (t, [ data[i] for i in indexes ]) for (t, data) in rows ]
+        
+        return rows
+
+    def iter_query(self, start, end):
+        """
+        Generate the (time, data) rows of query, reading one archive file at a
+        time so a long range is never all in memory at once
+        """
+        if not self.is_initialized():
+            return
+        
+        # Make sure everything written so far is in the files
+        writer = data_writer.get_writer()
+        if writer is not None:
+            writer.flush()
         
+        for (filepath, offset) in self.archive_index.find(start, end):
+            for row in self.storage.read_range(filepath, offset, start, end):
+                yield row
+
+    def load_file(self, filepath):
         logger.debug("loading: " + filepath)
         
-        if os.path.isfile(filepath):
-            f = open(filepath, 'r')
-            for line in f.readlines():
-                try:
-                    line_data = line.rstrip().split(',')
-                    
-                    dt = datetime.datetime.fromtimestamp(float(line_data[0]))
-                    year   = dt.strftime('%Y')
-                    month  = str(int(dt.strftime('%m')) - 1)  # javascript expects month in 0-11, strftime gives 1-12
-                    day    = dt.strftime('%d')
-                    hour   = dt.strftime('%H')
-                    minute = dt.strftime('%M')
-                    second = dt.strftime('%S')
-                    time_str = 'new Date(%s,%s,%s,%s,%s,%s)' % (year, month, day, hour, minute, second)
-                    
-                    data.append( {'time_str': time_str,
-                                  'time': float(line_data[0]),
-                                  'data': line_data[1:]} )
-                except ValueError:
-                    logger.warning("Error parsing line in %s : '%s'" % (filepath, line.strip()) )
-                
-            f.close()
+        data = DaySeries( self.storage.load_file(filepath) )
             
         logger.debug("got: " + str(len(data)) )
             
@@ -120,23 +205,20 @@ class DataLogger:
     def load_history(self):
         history = []
         
-        # For each file in the directory (sorted)
-        file_list = sorted( os.listdir( self.data_directory ) )
+        # For each archive file in the directory (sorted)
+        file_list = storage.get_archive_files(self.data_directory, self.archive_prefix, self.storage)
         recent_list = file_list[-MAX_DAYS_OF_HISTORY:]
         logger.info("Parsing %d of %d files" % ( len(recent_list), len(file_list) ) )
 
-        for filename in recent_list:
-            
-            filepath = os.path.join( self.data_directory, filename )
+        for filepath in recent_list:
             
-            # Skip links
-            if not os.path.islink(filepath):
-                
-                # Add an array to the data
-                history.append( self.load_file(filepath) )
+            # Add a day to the data
+            history.append( self.load_file(filepath) )
 
-        if len(history) == 0:
-            history = [[]]
+        # Make sure the last day is today, even if there is no file for it yet
+        if len(recent_list) == 0 or os.path.basename(recent_list[-1]) != self.get_todays_archive_name():
+            history.append( DaySeries() )
+            history = history[-MAX_DAYS_OF_HISTORY:]
 
         return history
 
@@ -157,50 +239,104 @@ class DataLogger:
                 return
 
         self.mutex.acquire()
+        try:
+            # Check if file needs to be changed
+            now = time.time()
+            if time.localtime(now).tm_mday != self.last_day:
+                self.last_day = time.localtime(now).tm_mday
+                
+                # Let go of yesterdays file
+                writer = data_writer.get_writer()
+                if writer is not None:
+                    writer.close_file(self.todays_filename)
+                    
+                self.setup_data_file()
+                self.start_new_day()
+            
+            # Write to the file, queue it if the write-behind writer is running
+            writer = data_writer.get_writer()
+            if writer is not None:
+                writer.write(self.todays_filename, self.storage.format_row(now, data))
+            else:
+                self.storage.append(self.todays_filename, now, data)
         
-        # Check if file needs to be changed
-        now = time.time()
-        if time.localtime(now).tm_mday != self.last_day:
-            self.last_day = time.localtime(now).tm_mday
-            self.setup_data_file()
-            self.data = self.load_history()
-        
-        # Build the data string
-        result = str(now)
-        for item in data:
-            result += "," + item
-    
-        # Write to the file
-        file_handle = open(self.filename, "a+")
-        file_handle.write(result)
-        file_handle.write("\n")
-        file_handle.flush()
-        file_handle.close()
-        
-        # Compute the javascript time string (probably not the best place for this)
-        dt = datetime.datetime.fromtimestamp(now)
-        year   = dt.strftime('%Y')
-        month  = str(int(dt.strftime('%m')) - 1)  # javascript expects month in 0-11, strftime gives 1-12
-        day    = dt.strftime('%d')
-        hour   = dt.strftime('%H')
-        minute = dt.strftime('%M')
-        second = dt.strftime('%S')
-        time_str = 'new Date(%s,%s,%s,%s,%s,%s)' % (year, month, day, hour, minute, second)
-    
-        # Add the data
-        self.data[-1].append({'time_str': time_str,
-                              'time': now,
-                              'data': data})
+            # Add the data
+            self.data[-1].append(now, data)
+            self.data_added(now, data)
+            self._version += 1
         
-        self.mutex.release()
+        finally:
+            self.mutex.release()
     
     
 if __name__ == "__main__":
+    import sys
+    import shutil
+    import tempfile
     from pprint import pprint
     
-    data_logger = DataLogger("data/temperature_data", "temperatures")
-    
-    data_logger.add_data(["one", "two", "three"])
+    #
+    # python data_logger_base.py benchmark [csv|binary]
+    #
+    # load_history and add_data throughput on 7 days of synthetic 2-minute
+    # samples, and what building the eager time_str of every loaded row cost
+    #
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        NUM_COLUMNS = 4
+        SAMPLES_PER_DAY = 720
+        NUM_ADDS = 5000
+        
+        def eager_time_string(timestamp):
+            dt = datetime.datetime.fromtimestamp(timestamp)
+            return 'new Date(%s,%s,%s,%s,%s,%s)' % (dt.strftime('%Y'), str(int(dt.strftime('%m')) - 1), dt.strftime('%d'),
+                                                     dt.strftime('%H'), dt.strftime('%M'), dt.strftime('%S'))
+        
+        if len(sys.argv) > 2 and sys.argv[2] == "binary":
+            data_storage = storage.BinaryStorage(NUM_COLUMNS)
+        else:
+            data_storage = storage.CsvStorage()
+        
+        directory = tempfile.mkdtemp()
+        try:
+            today = datetime.date.today()
+            for days_ago in range(MAX_DAYS_OF_HISTORY - 1, 0, -1):
+                day = today - datetime.timedelta(days=days_ago)
+                filepath = os.path.join(directory, day.strftime("bench_%Y_%m_%d") + data_storage.extension)
+                midnight = time.mktime(day.timetuple())
+                
+                data_storage.create_file(filepath)
+                f = open(filepath, 'ab')
+                for i in range(SAMPLES_PER_DAY):
+                    f.write( data_storage.format_row(midnight + 120 * i, [ "%.1f" % (68 + (i + c) % 50 / 10.0)
+                                                                          for c in range(NUM_COLUMNS) ]) )
+                f.close()
+            
+            start = time.time()
+            data_logger = DataLogger(directory, "bench", data_storage)
+            load_time = time.time() - start
+            num_rows = sum([ len(series) for series in data_logger.data ])
+            
+            start = time.time()
+            for series in data_logger.data:
+                for (timestamp, _) in series.rows():
+                    eager_time_string(timestamp)
+            eager_time = time.time() - start
+            
+            start = time.time()
+            for i in range(NUM_ADDS):
+                data_logger.add_data([ "%.1f" % (70 + i % 10) ] * NUM_COLUMNS)
+            add_time = time.time() - start
+            
+            print "%s storage, %d columns" % (data_storage.extension, NUM_COLUMNS)
+            print "load_history: %d rows in %.3f s, %.0f rows/s" % (num_rows, load_time, num_rows / load_time)
+            print "eager time_str of the same rows would add %.3f s" % eager_time
+            print "add_data:     %d rows in %.3f s, %.0f rows/s" % (NUM_ADDS, add_time, NUM_ADDS / add_time)
+        finally:
+            shutil.rmtree(directory)
     
-    pprint( data_logger.load_history() )
-
+    else:
+        data_logger = DataLogger("data/temperature_data", "temperatures")
+        
+        data_logger.add_data(["one", "two", "three"])
+        
+        pprint( data_logger.load_history() )
@@ -0,0 +1,192 @@
+
+import os
+import sys
+import time
+import Queue
+import logging
+from threading import Thread, Event, Lock
+
+logger = logging.getLogger('allspark.data_writer')
+
+# When to fsync the data files
+FSYNC_NEVER = "never"   # leave it to the operating system
+FSYNC_CLOSE = "close"   # when a day file is closed
+FSYNC_FLUSH = "flush"   # after every flush
+
+MAX_QUEUE_SIZE = 10000
+
+# Seconds flush waits for the writer before giving up
+FLUSH_TIMEOUT = 10.0
+
+# Markers passed through the queue along with (filepath, content) writes
+_CLOSE = "close"
+_FLUSH = "flush"
+_STOP = "stop"
+
+
+class DataWriter(Thread):
+    """
+    Write-behind appender shared by the data loggers. Appends are queued and
+    written by this thread through one open handle per file, the handles are
+    flushed every flush_interval seconds instead of after every sample.
+    """
+
+    def __init__(self, flush_interval=5.0, fsync_policy=FSYNC_NEVER):
+        Thread.__init__(self, name="data_writer")
+        self.daemon = True
+
+        self.flush_interval = flush_interval
+        self.fsync_policy = fsync_policy
+        self.queue = Queue.Queue(MAX_QUEUE_SIZE)
+        self.stopping = False
+        self.stop_lock = Lock()
+        self.files = {}
+        self.dirty = False
+        self.last_flush = time.time()
+
+    def write(self, filepath, content):
+        # Blocks only if the writer has fallen MAX_QUEUE_SIZE writes behind
+        self.stop_lock.acquire()
+        try:
+            if not self.stopping and self.is_alive():
+                self.queue.put( (filepath, content) )
+                return
+        finally:
+            self.stop_lock.release()
+
+        # Too late for the writer, write it directly instead of losing it
+        f = open(filepath, "ab")
+        f.write(content)
+        f.close()
+
+    def close_file(self, filepath):
+        self.stop_lock.acquire()
+        if not self.stopping and self.is_alive():
+            self.queue.put( (_CLOSE, filepath) )
+        self.stop_lock.release()
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """
+        Write out everything queued so far, returns True once it is on disk or
+        False if the writer is not running or did not get to it within timeout
+        seconds
+        """
+        done = Event()
+        self.stop_lock.acquire()
+        try:
+            if self.stopping or not self.is_alive():
+                return False
+            self.queue.put( (_FLUSH, done) )
+        finally:
+            self.stop_lock.release()
+
+        done.wait(timeout)
+        if not done.is_set():
+            logger.warning( "Data writer did not flush within %.1f seconds" % timeout )
+        return done.is_set()
+
+    def stop(self):
+        self.stop_lock.acquire()
+        if self.stopping:
+            self.stop_lock.release()
+            return
+        self.stopping = True
+        self.stop_lock.release()
+
+        if self.is_alive():
+            self.queue.put( (_STOP, None) )
+            self.join()
+
+    def run(self):
+        logger.info( "Thread started" )
+
+        while True:
+            # Only wake up for the flush interval when there is something to flush
+            try:
+                if self.dirty:
+                    timeout = max(0.0, self.last_flush + self.flush_interval - time.time())
+                    (target, content) = self.queue.get(True, timeout)
+                else:
+                    (target, content) = self.queue.get()
+            except Queue.Empty:
+                self.flush_files()
+                continue
+
+            try:
+                if target == _STOP:
+                    break
+                elif target == _FLUSH:
+                    self.flush_files()
+                    content.set()
+                elif target == _CLOSE:
+                    self.close(content)
+                else:
+                    self.append(target, content)
+            except (IOError, OSError):
+                logger.error( "Error writing data: " + repr(sys.exc_info()[1]) )
+
+            if self.dirty and time.time() - self.last_flush >= self.flush_interval:
+                self.flush_files()
+
+        for filepath in self.files.keys():
+            self.close(filepath)
+
+        logger.info( "Thread stopped" )
+
+    def append(self, filepath, content):
+        if filepath not in self.files:
+            self.files[filepath] = open(filepath, "ab")
+        self.files[filepath].write(content)
+        self.dirty = True
+
+    def close(self, filepath):
+        if filepath in self.files:
+            f = self.files.pop(filepath)
+            f.flush()
+            if self.fsync_policy in [FSYNC_CLOSE, FSYNC_FLUSH]:
+                os.fsync(f.fileno())
+            f.close()
+
+    def flush_files(self):
+        for f in self.files.values():
+            f.flush()
+            if self.fsync_policy == FSYNC_FLUSH:
+                os.fsync(f.fileno())
+        self.dirty = False
+        self.last_flush = time.time()
+
+
+_writer = None
+
+
+def configure(flush_interval=5.0, fsync_policy=FSYNC_NEVER):
+    """
+    Start the shared writer, after this the data loggers write behind through it
+    """
+    global _writer
+    if _writer is None:
+        if fsync_policy not in [FSYNC_NEVER, FSYNC_CLOSE, FSYNC_FLUSH]:
+            logger.warning( "Unknown fsync policy '" + fsync_policy + "', using '" + FSYNC_NEVER + "'" )
+            fsync_policy = FSYNC_NEVER
+        _writer = DataWriter(flush_interval, fsync_policy)
+        _writer.start()
+
+
+def get_writer():
+    """
+    The shared writer, or None if the loggers should write directly
+    """
+    return _writer
+
+
+def shutdown():
+    """
+    Write out everything still queued, close the files and stop the writer
+    """
+    global _writer
+    writer = _writer
+
+    # Loggers that write from now on write directly
+    _writer = None
+    if writer is not None:
+        writer.stop()
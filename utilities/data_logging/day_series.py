@@ -0,0 +1,102 @@
+
+import sys
+from array import array
+from itertools import izip
+
+
+class DataItem(object):
+    """
+    One sample, supports item['time'] and item['data'] like the dictionaries it replaces
+    """
+
+    __slots__ = ('time', 'data')
+
+    def __init__(self, timestamp, data):
+        self.time = timestamp
+        self.data = data
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+
+class DaySeries(object):
+    """
+    One day of samples stored as parallel columns: an array('d') of times and a
+    list of data tuples. Data strings are interned, and a row equal to the one
+    before it shares its tuple, so repeated values cost one pointer per sample.
+    """
+
+    __slots__ = ('times', 'values')
+
+    def __init__(self, rows=None):
+        self.times = array('d')
+        self.values = []
+
+        if rows is not None:
+            for (timestamp, data) in rows:
+                self.append(timestamp, data)
+
+    def append(self, timestamp, data):
+        row = tuple([ intern(item) if type(item) is str else item for item in data ])
+
+        if len(self.values) > 0 and self.values[-1] == row:
+            row = self.values[-1]
+
+        self.times.append(timestamp)
+        self.values.append(row)
+
+    def rows(self):
+        """
+        Iterate over (time, data) tuples without building DataItems
+        """
+        return izip(self.times, self.values)
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [ DataItem(t, v) for (t, v) in izip(self.times[index], self.values[index]) ]
+        return DataItem(self.times[index], self.values[index])
+
+    def __iter__(self):
+        for (timestamp, data) in self.rows():
+            yield DataItem(timestamp, data)
+
+    def get_size(self):
+        """
+        Approximate number of bytes used, not counting the shared interned strings
+        """
+        size = sys.getsizeof(self.times) + sys.getsizeof(self.values)
+        last = None
+        for row in self.values:
+            if row is not last:
+                size += sys.getsizeof(row)
+                last = row
+        return size
+
+
+if __name__ == "__main__":
+    import random
+
+    # Compare the old list of dictionaries with a DaySeries for a day of
+    # 2 minute temperature samples and a day of 10 second presence samples
+    def dict_size(rows):
+        size = sys.getsizeof(rows)
+        for row in rows:
+            size += sys.getsizeof(row) + sys.getsizeof(row['time']) + sys.getsizeof(row['data'])
+            size += sum([ sys.getsizeof(item) for item in row['data'] ])
+        return size
+
+    temperatures = [ (1.4e9 + i * 120, [ "%3.3f" % (70 + random.randint(0, 32) / 16.0) for _ in range(3) ])
+                     for i in range(720) ]
+    presence = [ (1.4e9 + i * 10, ["user_1"] if (i / 500) % 2 else []) for i in range(8640) ]
+
+    for name, rows in [("temperature", temperatures), ("presence", presence)]:
+        old = [ {'time': t, 'data': list(d)} for (t, d) in rows ]
+        new = DaySeries(rows)
+        print "%-12s samples: %5d  dict bytes/sample: %6.1f  DaySeries bytes/sample: %6.1f" % \
+            (name, len(rows), dict_size(old) / float(len(rows)), new.get_size() / float(len(rows)))
@@ -1,20 +1,73 @@
-
 import data_logger_base
 
 
 class PresenceLogger(data_logger_base.DataLogger):
     def __init__(self, log_directory, archive_prefix, data_item_names):
         self.data_item_names = data_item_names
+        
+        # Todays timeline: the rendered rows of the intervals that have ended,
+        # and item -> [start time, last present time] of the ones still open
+        self.closed_intervals = []
+        self.open_intervals = {}
+        self.interval_version = 0
+        
         data_logger_base.DataLogger.__init__(self, log_directory, archive_prefix)
         
+        for (row_time, row_data) in self.data[-1].rows():
+            self.data_added(row_time, row_data)
+    
+    def start_new_day(self):
+        data_logger_base.DataLogger.start_new_day(self)
+        
+        # Intervals still open at midnight start again with the first sample of the new day
+        self.closed_intervals = []
+        self.open_intervals = {}
+        self.interval_version += 1
+    
+    def data_added(self, timestamp, data):
+        for item in self.data_item_names:
+            interval = self.open_intervals.get(item)
+            
+            # Item is present
+            if item in data:
+                if interval is None:  # No start time yet, add it
+                    self.open_intervals[item] = [timestamp, timestamp]
+                    self.interval_version += 1
+                else:
+                    interval[1] = timestamp
+                    
+            # Item is not present
+            elif interval is not None:  # Has start time, add end time
+                self.closed_intervals.append( "['%s',  %s, %s]" % (
+                    item,
+                    data_logger_base.get_time_string(interval[0]),
+                    data_logger_base.get_time_string(interval[1])) )
+                del self.open_intervals[item]
+                self.interval_version += 1
+    
+    def get_version(self):
+        """
+        Changes whenever the timeline changes, not for every sample
+        """
+        return self.interval_version
+        
     def get_google_timeline_javascript(self, title, item_name, div_id, chart_options=None):
         
         jscript = ""
         if self.is_initialized():
             
-            # Get the most recent data set (all the data from today)
-            dataset = self.get_data_set()
-            if dataset is None or len( dataset ) == 0:
+            # Copy todays intervals (all the data from today)
+            self.mutex.acquire()
+            timeline = list(self.closed_intervals)
+            for item in self.data_item_names:
+                if item in self.open_intervals:
+                    # Still present, the bar runs up to when the page is shown
+                    timeline.append( "['%s',  %s, new Date()]" % (
+                        item,
+                        data_logger_base.get_time_string(self.open_intervals[item][0])) )
+            self.mutex.release()
+            
+            if len( timeline ) == 0:
                 return "// None available"
 
             options = "{ title: '%s'%s }" % (title, "%s")
@@ -26,7 +79,7 @@ class PresenceLogger(data_logger_base.DataLogger):
                 options %= ""
             
             # Build the return string
-            return_string = """
+            jscript = """
     
             var dataTable = new google.visualization.DataTable();
     
@@ -44,50 +97,34 @@ class PresenceLogger(data_logger_base.DataLogger):
             var options = %s;
             chart.draw(dataTable, options);
             
-            """ % (item_name, "%s", div_id, options)
-
-            # Initialize the state dictionaries
-            start_times = {}
-            last_present_times = {}
-            for item in self.data_item_names:
-                start_times[item] = None
-                last_present_times[item] = None
-            
-            # Go through the data and write out a string whenever the item
-            # is no longer present.
-            return_string_data = ""
-            
-            for row in dataset:
-                row_time = row['time_str']
-                row_data = row['data']
-                
-                for item in self.data_item_names:
-                    # Item is present
-                    if item in row_data:
-                        if start_times[item] is None:  # No start time yet, add it
-                            start_times[item] = row_time
-                        last_present_times[item] = row_time
-                            
-                    # Item is not present
-                    else:
-                        if start_times[item] is not None:  # Has start time, add end time
-                            # write a string
-                            return_string_data += ("['%s',  %s, %s],\n" % (item,
-                                                                           start_times[item],
-                                                                           last_present_times[item]))
-                            # reset start time
-                            start_times[item] = None
-                            last_present_times[item] = None
-            
-            # Make sure any items currently present get closed properly
-            for item in self.data_item_names:
-                if start_times[item] is not None:
-                    return_string_data += ("['%s',  %s, %s],\n" % (item, start_times[item], last_present_times[item]))
-                    
-            # Remove the trailing comma and return line    
-            if return_string_data.endswith(",\n"):
-                return_string_data = return_string_data[:-2]
-            
-            jscript = return_string % return_string_data
+            """ % (item_name, ",\n".join(timeline), div_id, options)
             
         return jscript
+
+if __name__ == "__main__":
+    import time
+    import shutil
+    import tempfile
+
+    #
+    # Benchmark: time to render the timeline for a growing day of 10 second samples
+    # of three users coming and going
+    #
+    data_directory = tempfile.mkdtemp()
+    presence_logger = PresenceLogger(data_directory, "users", ["user_1", "user_2", "user_3"])
+
+    start = time.time() - 86400
+    for hours in [1, 6, 12, 24]:
+        rows = []
+        for i in range(hours * 360):
+            rows.append( (start + i * 10, [ "user_%d" % u for u in range(1, 4) if (i / (60 * u)) % 2 == 0 ]) )
+        presence_logger.start_new_day()
+        for (row_time, row_data) in rows:
+            presence_logger.data_added(row_time, row_data)
+
+        t = time.time()
+        for _ in range(10):
+            presence_logger.get_google_timeline_javascript("Users", "User", "user_chart_div")
+        print "%2d hours, %5d rows: %7.2f ms per render" % (hours, len(rows), (time.time() - t) * 100)
+
+    shutil.rmtree(data_directory)
@@ -0,0 +1,170 @@
+
+import os
+import logging
+from threading import Lock
+
+import storage
+import data_writer
+from archive_index import index_file, find_offset
+
+logger = logging.getLogger('allspark.data_logger')
+
+# (name, bucket width in seconds) of each resolution, finest first
+TIERS = [("1m", 60),
+         ("15m", 900),
+         ("1h", 3600),
+         ("1d", 86400)]
+
+
+class RollupTier:
+    """
+    Min/max/mean of each value over fixed width time buckets (aligned to UTC),
+    updated as samples arrive. Each closed bucket is appended to
+    "<prefix>.rollup_<name><extension>" next to the raw files as a row of:
+    bucket start, mean_1 .. mean_n, min_1 .. min_n, max_1 .. max_n
+
+    add is called with the logger mutex held and only queues the closed
+    buckets, write_pending writes them out after the mutex is released.
+    """
+
+    def __init__(self, data_directory, archive_prefix, name, width, num_columns, data_storage):
+        self.name = name
+        self.width = width
+        self.num_columns = num_columns
+        self.filename = os.path.join(data_directory, archive_prefix + ".rollup_" + name + data_storage.extension)
+
+        if isinstance(data_storage, storage.BinaryStorage):
+            self.storage = storage.BinaryStorage(3 * num_columns)
+
+            # The means, mins and maxs can not be padded to another number of
+            # columns, start over and backfill from the history instead
+            if os.path.isfile(self.filename) and self.storage.get_num_columns(self.filename) != 3 * num_columns:
+                logger.warning( "Number of columns changed, moving " + self.filename + " to .old" )
+                os.rename(self.filename, self.filename + ".old")
+        else:
+            self.storage = storage.CsvStorage()
+
+        self.storage.create_file(self.filename)
+
+        self.index_entry = None
+        self.bucket_start = None
+        self.stats = None
+
+        # Closed bucket rows waiting for write_pending, and the file's index
+        self.lock = Lock()
+        self.pending = []
+
+        # Buckets before this time are already in the file
+        self.saved_end = self.get_saved_end()
+
+    def get_saved_end(self):
+        if not os.path.isfile(self.filename):
+            return 0.0
+
+        self.index_entry, _ = index_file(self.storage, self.filename, self.index_entry)
+        if self.index_entry['end'] is None:
+            return 0.0
+        return self.index_entry['end'] + self.width
+
+    def add(self, timestamp, data):
+        bucket_start = timestamp - (timestamp % self.width)
+        if bucket_start < self.saved_end:
+            return
+
+        if bucket_start != self.bucket_start:
+            self.close_bucket()
+            self.bucket_start = bucket_start
+            self.stats = [ None ] * self.num_columns
+
+        for column, item in enumerate(data[:self.num_columns]):
+            try:
+                value = float(item)
+            except (ValueError, TypeError):
+                continue
+            if value != value:  # NaN
+                continue
+
+            stat = self.stats[column]
+            if stat is None:
+                self.stats[column] = [value, value, value, 1]
+            else:
+                stat[0] = min(stat[0], value)
+                stat[1] = max(stat[1], value)
+                stat[2] += value
+                stat[3] += 1
+
+    def close_bucket(self):
+        if self.bucket_start is None:
+            return
+
+        means = []
+        mins = []
+        maxs = []
+        for stat in self.stats:
+            if stat is None:
+                means.append("null")
+                mins.append("null")
+                maxs.append("null")
+            else:
+                means.append(repr(stat[2] / stat[3]))
+                mins.append(repr(stat[0]))
+                maxs.append(repr(stat[1]))
+
+        if any([ m != "null" for m in means ]):
+            row = self.storage.format_row(self.bucket_start, means + mins + maxs)
+            self.lock.acquire()
+            self.pending.append(row)
+            self.lock.release()
+
+        self.saved_end = self.bucket_start + self.width
+        self.bucket_start = None
+        self.stats = None
+
+    def write_pending(self):
+        """
+        Append the closed buckets to the file, call without the logger mutex held
+        """
+        self.lock.acquire()
+        try:
+            rows = self.pending
+            self.pending = []
+            if len(rows) == 0:
+                return
+
+            writer = data_writer.get_writer()
+            if writer is not None:
+                writer.write(self.filename, "".join(rows))
+            else:
+                f = open(self.filename, "ab")
+                f.write("".join(rows))
+                f.close()
+        finally:
+            self.lock.release()
+
+    def query(self, start, end):
+        """
+        Get the saved (bucket start, [means + mins + maxs]) rows between start and end
+        """
+        if not os.path.isfile(self.filename):
+            return []
+
+        writer = data_writer.get_writer()
+        if writer is not None:
+            writer.flush()
+
+        self.lock.acquire()
+        try:
+            self.index_entry, _ = index_file(self.storage, self.filename, self.index_entry)
+            entry = self.index_entry
+        finally:
+            self.lock.release()
+
+        if entry['start'] is None:
+            return []
+
+        return self.storage.read_range(self.filename, find_offset(entry, start), start, end)
+
+
+def create_tiers(data_directory, archive_prefix, num_columns, data_storage):
+    return [ RollupTier(data_directory, archive_prefix, name, width, num_columns, data_storage)
+             for (name, width) in TIERS ]
@@ -0,0 +1,353 @@
+
+import os
+import sys
+import math
+import array
+import struct
+import logging
+
+logger = logging.getLogger('allspark.data_logger')
+
+# Binary files start with the magic and their number of columns, 8 bytes
+# so the float64 records after it stay aligned
+BINARY_MAGIC = "ASB1"
+BINARY_HEADER_FORMAT = "<4sI"
+BINARY_HEADER_SIZE = struct.calcsize(BINARY_HEADER_FORMAT)
+
+# More columns than this means the file has no header and starts with a record
+MAX_BINARY_COLUMNS = 4096
+
+
+class CsvStorage:
+    """
+    Text storage, one line per sample: "time,item,item,..."
+    """
+
+    extension = ".csv"
+
+    def __init__(self):
+        pass
+
+    def load_file(self, filepath):
+        rows = []
+
+        if os.path.isfile(filepath):
+            f = open(filepath, 'r')
+            for line in f.readlines():
+                try:
+                    line_data = line.rstrip().split(',')
+                    rows.append( (float(line_data[0]), line_data[1:]) )
+                except ValueError:
+                    logger.warning("Error parsing line in %s : '%s'" % (filepath, line.strip()) )
+            f.close()
+
+        return rows
+
+    @staticmethod
+    def format_row(timestamp, data):
+        result = str(timestamp)
+        for item in data:
+            result += "," + item
+        return result + "\n"
+
+    @staticmethod
+    def create_file(filepath):
+        """
+        Make sure the file exists, returns True if an existing file was rewritten
+        """
+        open(filepath, 'a').close()
+        return False
+
+    def append(self, filepath, timestamp, data):
+        file_handle = open(filepath, "a+")
+        file_handle.write(self.format_row(timestamp, data))
+        file_handle.flush()
+        file_handle.close()
+
+    @staticmethod
+    def scan_file(filepath, offset=0):
+        """
+        Generate (time, row offset, next row offset) for every complete row from offset to the end of the file
+        """
+        f = open(filepath, 'rb')
+        f.seek(offset)
+        for line in iter(f.readline, ''):
+            if not line.endswith("\n"):
+                break
+            next_offset = offset + len(line)
+            try:
+                yield ( float(line[:line.find(',')] if ',' in line else line), offset, next_offset )
+            except ValueError:
+                pass
+            offset = next_offset
+        f.close()
+
+    @staticmethod
+    def read_range(filepath, offset, start, end):
+        """
+        Read the (time, data) rows with start <= time <= end, beginning at the row at offset
+        """
+        rows = []
+        f = open(filepath, 'rb')
+        f.seek(offset)
+        for line in f:
+            try:
+                line_data = line.rstrip().split(',')
+                timestamp = float(line_data[0])
+            except ValueError:
+                continue
+            if timestamp > end:
+                break
+            if timestamp >= start:
+                rows.append( (timestamp, line_data[1:]) )
+        f.close()
+        return rows
+
+
+class BinaryStorage:
+    """
+    Fixed width binary storage for numeric data. A file starts with a header of
+    BINARY_MAGIC and its number of columns, followed by records of
+    little-endian float64 values: the time and then one value per column.
+    Items that are not numbers are stored as NaN and loaded back as "null".
+    Each file is read with its own number of columns, so archives written
+    before a device was added or removed still load.
+    """
+
+    extension = ".bin"
+
+    def __init__(self, num_columns):
+        self.num_columns = num_columns
+        self.record_format = self.get_record_format(num_columns)
+        self.record_size = struct.calcsize(self.record_format)
+
+    @staticmethod
+    def get_record_format(num_columns):
+        return "<%dd" % (num_columns + 1)
+
+    def header(self):
+        return struct.pack(BINARY_HEADER_FORMAT, BINARY_MAGIC, self.num_columns)
+
+    def read_header(self, f):
+        """
+        (number of columns, offset of the first record) of an open file. Files
+        without a header are assumed to have the current number of columns.
+        """
+        f.seek(0)
+        content = f.read(BINARY_HEADER_SIZE)
+        if len(content) == BINARY_HEADER_SIZE:
+            (magic, num_columns) = struct.unpack(BINARY_HEADER_FORMAT, content)
+            if magic == BINARY_MAGIC and num_columns <= MAX_BINARY_COLUMNS:
+                return num_columns, BINARY_HEADER_SIZE
+        return self.num_columns, 0
+
+    def get_num_columns(self, filepath):
+        f = open(filepath, 'rb')
+        (num_columns, _) = self.read_header(f)
+        f.close()
+        return num_columns
+
+    def create_file(self, filepath):
+        """
+        Make sure a file exists to append records of the current width to. A new
+        file gets a header, a file with another number of columns or without a
+        header is rewritten with its records padded or cut to the current
+        width. Returns True if an existing file was rewritten.
+        """
+        if not os.path.isfile(filepath) or os.path.getsize(filepath) == 0:
+            f = open(filepath, 'wb')
+            f.write(self.header())
+            f.close()
+            return False
+
+        f = open(filepath, 'rb')
+        (num_columns, data_offset) = self.read_header(f)
+        f.close()
+        if data_offset > 0 and num_columns == self.num_columns:
+            return False
+
+        logger.warning("Rewriting %s with a header for %d columns" % (filepath, self.num_columns))
+
+        padding = ["null"] * self.num_columns
+        records = [ self.format_row(t, (list(data) + padding)[:self.num_columns])
+                    for (t, data) in self.load_file(filepath) ]
+
+        temp_filepath = filepath + ".tmp"
+        f = open(temp_filepath, 'wb')
+        f.write(self.header())
+        f.write("".join(records))
+        f.close()
+        os.rename(temp_filepath, filepath)
+        return True
+
+    def load_file(self, filepath):
+        rows = []
+
+        if os.path.isfile(filepath):
+            (values, num_columns) = self.load_array(filepath)
+            width = num_columns + 1
+
+            for start in range(0, len(values), width):
+                data = []
+                for value in values[start + 1:start + width]:
+                    if math.isnan(value):
+                        data.append("null")
+                    else:
+                        data.append(repr(value))
+                rows.append( (values[start], data) )
+
+        return rows
+
+    def load_array(self, filepath):
+        """
+        Read a whole file into a flat array('d') of [time, col_1, ..., col_n, time, ...],
+        returns the array and the number of columns of the file
+        """
+        f = open(filepath, 'rb')
+        (num_columns, data_offset) = self.read_header(f)
+        f.seek(data_offset)
+        content = f.read()
+        f.close()
+
+        # Drop a partial record left by an interrupted write
+        extra = len(content) % struct.calcsize(self.get_record_format(num_columns))
+        if extra != 0:
+            logger.warning("Ignoring %d trailing bytes in %s" % (extra, filepath))
+            content = content[:-extra]
+
+        values = array.array('d')
+        values.fromstring(content)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values, num_columns
+
+    def format_row(self, timestamp, data):
+        if len(data) != self.num_columns:
+            logger.warning("Expected %d items, got %d: %s" % (self.num_columns, len(data), str(data)))
+            data = (list(data) + ["null"] * self.num_columns)[:self.num_columns]
+
+        values = [float(timestamp)]
+        for item in data:
+            try:
+                values.append(float(item))
+            except (ValueError, TypeError):
+                values.append(float('nan'))
+
+        return struct.pack(self.record_format, *values)
+
+    def append(self, filepath, timestamp, data):
+        # The logger brings an existing file to the current width when it starts using it
+        if not os.path.isfile(filepath) or os.path.getsize(filepath) == 0:
+            self.create_file(filepath)
+
+        file_handle = open(filepath, "ab")
+        file_handle.write(self.format_row(timestamp, data))
+        file_handle.flush()
+        file_handle.close()
+
+    def scan_file(self, filepath, offset=0):
+        """
+        Generate (time, row offset, next row offset) for every complete record from offset to the end of the file
+        """
+        f = open(filepath, 'rb')
+        (num_columns, data_offset) = self.read_header(f)
+        record_size = struct.calcsize(self.get_record_format(num_columns))
+        offset = max(offset, data_offset)
+        f.seek(offset)
+        content = f.read()
+        f.close()
+
+        for position in range(0, len(content) - record_size + 1, record_size):
+            (timestamp,) = struct.unpack_from("<d", content, position)
+            yield ( timestamp, offset + position, offset + position + record_size )
+
+    def read_range(self, filepath, offset, start, end):
+        """
+        Read the (time, data) rows with start <= time <= end, beginning at the record at offset
+        """
+        rows = []
+        f = open(filepath, 'rb')
+        (num_columns, data_offset) = self.read_header(f)
+        record_format = self.get_record_format(num_columns)
+        record_size = struct.calcsize(record_format)
+        f.seek(max(offset, data_offset))
+
+        done = False
+        while not done:
+            content = f.read(record_size * 256)
+            if len(content) < record_size:
+                break
+
+            for position in range(0, len(content) - record_size + 1, record_size):
+                values = struct.unpack_from(record_format, content, position)
+                if values[0] > end:
+                    done = True
+                    break
+                if values[0] >= start:
+                    data = [ "null" if math.isnan(v) else repr(v) for v in values[1:] ]
+                    rows.append( (values[0], data) )
+
+            # Step back over a partial record at the end of the chunk
+            extra = len(content) % record_size
+            if extra != 0:
+                f.seek(-extra, os.SEEK_CUR)
+
+        f.close()
+        return rows
+
+
+def get_archive_files(data_directory, archive_prefix, storage):
+    """
+    Sorted list of the daily archive files for this prefix and storage format
+    """
+    result = []
+    for filename in sorted( os.listdir( data_directory ) ):
+        if filename.startswith(archive_prefix + "_") and filename.endswith(storage.extension):
+            filepath = os.path.join(data_directory, filename)
+            if not os.path.islink(filepath):
+                result.append(filepath)
+    return result
+
+
+def convert_archive(data_directory, archive_prefix, from_storage, to_storage):
+    """
+    Convert every daily archive file in a directory from one storage format to
+    another, for example existing CSV archives to binary, or binary to CSV for
+    export. The original files are left in place.
+    """
+    converted = []
+
+    for filepath in get_archive_files(data_directory, archive_prefix, from_storage):
+        new_filepath = filepath[:-len(from_storage.extension)] + to_storage.extension
+
+        if os.path.exists(new_filepath):
+            logger.warning("Skipping " + filepath + ", " + new_filepath + " already exists")
+            continue
+
+        to_storage.create_file(new_filepath)
+        f = open(new_filepath, 'ab')
+        for (timestamp, data) in from_storage.load_file(filepath):
+            f.write(to_storage.format_row(timestamp, data))
+        f.close()
+
+        converted.append(new_filepath)
+
+    return converted
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) != 5 or sys.argv[1] not in ["to-binary", "to-csv"]:
+        print "Usage: python %s to-binary|to-csv <data directory> <archive prefix> <number of columns>" % sys.argv[0]
+        sys.exit(1)
+
+    csv_storage = CsvStorage()
+    binary_storage = BinaryStorage(int(sys.argv[4]))
+
+    if sys.argv[1] == "to-binary":
+        files = convert_archive(sys.argv[2], sys.argv[3], csv_storage, binary_storage)
+    else:
+        files = convert_archive(sys.argv[2], sys.argv[3], binary_storage, csv_storage)
+
+    for name in files:
+        print "Created:", name
@@ -1,9 +1,22 @@
 
+import time
+import logging
+from threading import Thread
 import data_logger_base
+import storage
+import rollup
+
+logger = logging.getLogger('allspark.data_logger')
+
+# Charts of spans longer than this use a rollup tier instead of the raw data
+MAX_RAW_SPAN = 86400
+
+# Use the finest rollup tier that gives at most this many points for the span
+MAX_CHART_POINTS = 1000
 
 
 class ValueLogger(data_logger_base.DataLogger):
-    def __init__(self, log_directory, archive_prefix, value_names):
+    def __init__(self, log_directory, archive_prefix, value_names, storage_format="csv"):
         
         if isinstance(value_names, list):
             self.value_names = value_names
@@ -13,7 +26,128 @@ class ValueLogger(data_logger_base.DataLogger):
             print "ValueLogger: Unsupported input type: " + str( type(value_names) )
             return
             
-        data_logger_base.DataLogger.__init__(self, log_directory, archive_prefix)
+        if storage_format == "binary":
+            data_storage = storage.BinaryStorage(len(self.value_names))
+        else:
+            data_storage = storage.CsvStorage()
+            
+        data_logger_base.DataLogger.__init__(self, log_directory, archive_prefix, data_storage)
+        
+        self.rollup_tiers = rollup.create_tiers(log_directory, archive_prefix, len(self.value_names), data_storage)
+        
+        # Until the backfill is done the tiers are missing buckets, charts use the raw data
+        self.backfilled = False
+        self.backfill_thread = Thread(target=self.backfill_rollups, name=archive_prefix + "_rollup_backfill")
+        self.backfill_thread.daemon = True
+        self.backfill_thread.start()
+    
+    def backfill_rollups(self):
+        """
+        Catch up on the buckets that were not saved before the last shutdown, from
+        the archive files so days older than the history in memory are rolled up
+        too. Runs in the background, the first run reads the whole archive once.
+        """
+        try:
+            # Samples up to the cutoff are read without holding the mutex,
+            # the ones added meanwhile do not reach the tiers yet
+            self.mutex.acquire()
+            cutoff = time.time()
+            self.mutex.release()
+            
+            start = min([ tier.saved_end for tier in self.rollup_tiers ])
+            count = 0
+            for (timestamp, data) in self.iter_query(start, cutoff):
+                for tier in self.rollup_tiers:
+                    tier.add(timestamp, data)
+                count += 1
+                if count % 10000 == 0:
+                    self.write_rollups()
+            
+            # Then the samples added since the cutoff, with the mutex held so
+            # none are missed before data_added takes over
+            self.mutex.acquire()
+            try:
+                for (timestamp, data) in self.iter_query(cutoff, time.time()):
+                    if timestamp > cutoff:
+                        for tier in self.rollup_tiers:
+                            tier.add(timestamp, data)
+                self.backfilled = True
+            finally:
+                self.mutex.release()
+            
+            self.write_rollups()
+            logger.info( "Rolled up %d %s samples" % (count, self.archive_prefix) )
+            
+        except Exception:
+            logger.exception( "Failed to backfill the " + self.archive_prefix + " rollups" )
+    
+    def data_added(self, timestamp, data):
+        if not self.backfilled:
+            return
+        for tier in self.rollup_tiers:
+            tier.add(timestamp, data)
+    
+    def add_data(self, data):
+        data_logger_base.DataLogger.add_data(self, data)
+        self.write_rollups()
+    
+    def write_rollups(self):
+        # Outside the logger mutex, sampling does not wait on the rollup files
+        for tier in self.rollup_tiers:
+            tier.write_pending()
+    
+    def get_column_names(self):
+        return self.value_names
+    
+    def select_tier(self, span_seconds, max_points=None):
+        """
+        The rollup tier to chart a span of time with, or None for the raw data.
+        Without max_points spans up to MAX_RAW_SPAN are charted from the raw data.
+        The raw data is also used until the tiers are backfilled.
+        """
+        if not self.backfilled:
+            return None
+        
+        if max_points is None:
+            if span_seconds <= MAX_RAW_SPAN:
+                return None
+            max_points = MAX_CHART_POINTS
+        elif span_seconds / self.rollup_tiers[0].width <= max_points:
+            return None
+        
+        for tier in self.rollup_tiers:
+            if span_seconds / tier.width <= max_points:
+                return tier
+        return self.rollup_tiers[-1]
+    
+    def query_rollup(self, tier, start, end):
+        """
+        Get the (bucket start, [means + mins + maxs]) rows of a tier between start and end
+        """
+        return tier.query(start, end)
+    
+    def get_load_data_javascript(self, callback_name, span_seconds=None):
+        """
+        Javascript that fetches the data for the span (todays data by default) from
+        the daemons /data endpoint and passes it to the named function
+        """
+        url = '"/data?logger=%s"' % self.archive_prefix
+        if span_seconds is not None:
+            # Whole minutes, so repeated loads ask for the same range and get a 304
+            url += ' + "&start=" + (Math.floor(Date.now() / 60000) * 60 - %d)' % span_seconds
+        
+        if isinstance(self.storage, storage.BinaryStorage):
+            return """
+                var request = new XMLHttpRequest();
+                request.open("GET", allspark_server + %s + "&format=binary", true);
+                request.responseType = "arraybuffer";
+                request.onload = function () { %s(request.response); };
+                request.send();
+                """ % ( url, callback_name )
+        
+        return """
+                $.getJSON(allspark_server + %s, function (data) { %s(data);  })
+                """ % ( url, callback_name )
     
     def get_google_linechart_javascript(self, title, div_id, chart_options=None):
         jscript = ""
@@ -36,42 +170,50 @@ class ValueLogger(data_logger_base.DataLogger):
             else:
                 options %= ""
             
-            jscript = """
+            if isinstance(self.storage, storage.BinaryStorage):
+                parse_jscript = """
                 
-                var rows = data.split('\\n');
+                var values = new Float64Array(data);
                 
                 var result = [['Time', %s ]];
                 
-                for ( var i = 0; i < rows.length; i++)
+                for ( var i = 0; i + %d <= values.length; i += %d)
                 {
-                    var row = rows[i];
-                    var items = row.split(",");
-                    if (items.length != %d)
-                        continue;
+                    var d = new Date(values[i] * 1000);
                     
-                    var time = items[0];
-                    var d = new Date(0); // The 0 there is the key, which sets the date to the epoch
-                    d.setUTCSeconds(parseInt(time));
-                    
-                    data = [d]
-                    for ( var j = 1; j < items.length; j++)
+                    var row = [d]
+                    for ( var j = 1; j < %d; j++)
                     {
-                        t = parseFloat( items[j] );
-                        if (t == NaN)
+                        var t = values[i + j];
+                        if (isNaN(t))
                         {
                             t = null;
                         }
-                        data.push( t );
+                        row.push( t );
                     }
                     
-                    result.push( data );
+                    result.push( row );
+                }
+                """ % ( legend_str, len(self.value_names) + 1, len(self.value_names) + 1, len(self.value_names) + 1 )
+            else:
+                parse_jscript = """
+                
+                var result = [['Time', %s ]];
+                
+                for ( var i = 0; i < data.rows.length; i++)
+                {
+                    var row = data.rows[i];
+                    result.push( [new Date(row[0] * 1000)].concat( row.slice(1) ) );
                 }
+                """ % legend_str
+            
+            jscript = parse_jscript + """
                 
                 var data = google.visualization.arrayToDataTable(result);
                 var options = %s;
                 var chart = new google.visualization.LineChart(document.getElementById('%s'));
                 chart.draw(data, options);
                 
-                """ % ( legend_str, len(self.value_names) + 1, options, div_id )
+                """ % ( options, div_id )
         
         return jscript
@@ -0,0 +1,208 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import time
+import heapq
+import fcntl
+import select
+import logging
+import traceback
+from threading import Thread, Lock
+
+logger = logging.getLogger('allspark.event_loop')
+
+# Most bytes read from a stream per wakeup
+READ_SIZE = 4096
+
+
+class Timer:
+    """
+    Handle of a call scheduled with call_later or call_at
+    """
+
+    def __init__(self, when, func, args):
+        self.when = when
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventLoop(Thread):
+    """
+    One thread that waits in select() on every registered socket, pipe and
+    timer, instead of a thread per socket waking up every second to check.
+    Callbacks run on this thread and must not block. All the methods can be
+    called from any thread, other threads' requests wake the loop through a pipe.
+    """
+
+    def __init__(self):
+        Thread.__init__(self, name="event_loop")
+        self.daemon = True
+
+        self._running = False
+        self._lock = Lock()
+        self._pending = []
+        self._timers = []
+        self._timer_count = 0
+        self._readers = {}
+
+        self._wake_read, self._wake_write = os.pipe()
+        for fd in [self._wake_read, self._wake_write]:
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        self._initialized = True
+
+    def is_initialized(self):
+        return self._initialized
+
+    def is_running(self):
+        return self._running
+
+    def wake(self):
+        try:
+            os.write(self._wake_write, "x")
+        except OSError:
+            pass  # the pipe is full, the loop is waking up anyway
+
+    def call_soon(self, func, *args):
+        self._lock.acquire()
+        self._pending.append( (func, args) )
+        self._lock.release()
+        self.wake()
+
+    def call_at(self, when, func, *args):
+        timer = Timer(when, func, args)
+        self._lock.acquire()
+        self._timer_count += 1
+        heapq.heappush(self._timers, (when, self._timer_count, timer))
+        self._lock.release()
+        self.wake()
+        return timer
+
+    def call_later(self, delay, func, *args):
+        return self.call_at(time.time() + delay, func, *args)
+
+    def add_reader(self, fileobj, func):
+        """
+        Call func() whenever fileobj (anything with a fileno()) is readable
+        """
+        self.call_soon(self._readers.__setitem__, fileobj.fileno(), func)
+
+    def remove_reader(self, fileobj):
+        self.call_soon(self._readers.pop, fileobj.fileno(), None)
+
+    def add_line_reader(self, fileobj, func):
+        """
+        Call func(line) for every line read from a pipe, for example the stdout of
+        a subprocess, and func(None) at the end of the stream
+        """
+        fd = fileobj.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        buffered = [""]
+
+        def read_lines():
+            try:
+                content = os.read(fd, READ_SIZE)
+            except OSError:
+                return
+
+            if content == "":
+                self._readers.pop(fd, None)
+                if buffered[0] != "":
+                    func(buffered[0])
+                func(None)
+                return
+
+            lines = (buffered[0] + content).split("\n")
+            buffered[0] = lines.pop()
+            for line in lines:
+                func(line + "\n")
+
+        self.add_reader(fileobj, read_lines)
+
+    def stop(self):
+        if self._running:
+            self._running = False
+            self.wake()
+            self.join()
+
+    def run_callback(self, func, args):
+        try:
+            func(*args)
+        except Exception as e:
+            tb = "".join( traceback.format_tb(sys.exc_info()[2]) )
+            logger.error( "exception in callback " + getattr(func, "__name__", repr(func)) + ": \n" + tb + "\n" + str(e) )
+
+    def run(self):
+        logger.info( "Thread started" )
+
+        self._running = True
+        while self._running:
+
+            # Calls from other threads
+            self._lock.acquire()
+            pending = self._pending
+            self._pending = []
+            self._lock.release()
+
+            for (func, args) in pending:
+                self.run_callback(func, args)
+
+            # Timers that are due
+            now = time.time()
+            due = []
+            self._lock.acquire()
+            while len(self._timers) > 0 and self._timers[0][0] <= now:
+                due.append( heapq.heappop(self._timers)[2] )
+            timeout = self._timers[0][0] - now if len(self._timers) > 0 else None
+            self._lock.release()
+
+            for timer in due:
+                if not timer.cancelled:
+                    self.run_callback(timer.func, timer.args)
+
+            if len(due) > 0:
+                # The timers may have scheduled more work, check again before sleeping
+                continue
+
+            try:
+                (readable, _, _) = select.select(self._readers.keys() + [self._wake_read], [], [], timeout)
+            except select.error:
+                continue  # interrupted by a signal
+
+            for fd in readable:
+                if fd == self._wake_read:
+                    try:
+                        while os.read(self._wake_read, READ_SIZE):
+                            pass
+                    except OSError:
+                        pass
+                elif fd in self._readers:
+                    self.run_callback(self._readers[fd], ())
+
+        logger.info( "Thread stopped" )
+
+
+#
+# MAIN
+#
+if __name__ == "__main__":
+    import subprocess
+
+    loop = EventLoop()
+    loop.start()
+
+    start = time.time()
+    loop.call_later(0.5, lambda: sys.stdout.write("timer: %.3f s\n" % (time.time() - start)))
+    loop.call_later(0.2, lambda: sys.stdout.write("cancelled timer ran\n")).cancel()
+
+    proc = subprocess.Popen(["sh", "-c", "for i in 1 2 3; do echo line $i; sleep 0.1; done"], stdout=subprocess.PIPE)
+    loop.add_line_reader(proc.stdout, lambda line: sys.stdout.write("read: %r\n" % line))
+
+    time.sleep(1)
+    proc.wait()
+    loop.stop()
@@ -1,22 +1,272 @@
 #!/usr/bin/env python
 
-import socket
 import time
+import Queue
+import socket
+import logging
+from threading import Thread, Event, Lock
+
+logger = logging.getLogger('allspark.graphite_logging')
 
 CARBON_SERVER = 'home-server'
 CARBON_PORT   = 2003
 
+MAX_QUEUE_SIZE = 10000
 
-def send_data(name, value):
-    message = '%s %s %d\n' % ( str(name), str(value), int(time.time()) )
+# Most metrics sent in one write
+BATCH_SIZE = 500
+
+CONNECT_TIMEOUT = 5.0
+SEND_TIMEOUT = 10.0
+
+# Seconds to wait before reconnecting, doubled after each failure
+MIN_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+# Marker passed through the queue to stop the shipper
+_STOP = "stop"
+
+
+class GraphiteShipper(Thread):
+    """
+    Sends metrics to carbon in the background over one connection that is
+    kept open. Metrics are queued by send_data without blocking and written in
+    batches of plaintext lines. While carbon is unreachable the shipper
+    reconnects with a growing delay and metrics wait in the queue, once the
+    queue is full new metrics are dropped and counted.
+    """
+
+    def __init__(self, server=CARBON_SERVER, port=CARBON_PORT, max_queue_size=MAX_QUEUE_SIZE):
+        Thread.__init__(self, name="graphite_shipper")
+        self.daemon = True
+
+        self.server = server
+        self.port = port
+        self.queue = Queue.Queue(max_queue_size)
+        self.sock = None
+        self.batch = []
+        self.backoff = MIN_BACKOFF
+        self._stop_event = Event()
+
+        self.sent = 0
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.connect_failures = 0
+
+    def put(self, line):
+        """
+        Queue one metric line, never blocks. Returns False if it was dropped.
+        """
+        try:
+            self.queue.put_nowait(line)
+            return True
+        except Queue.Full:
+            self.dropped += 1
+            return False
+
+    def get_stats(self):
+        return {"sent": self.sent,
+                "dropped": self.dropped,
+                "queued": self.queue.qsize() + len(self.batch),
+                "connect_failures": self.connect_failures}
+
+    def stop(self, timeout=None):
+        """
+        Send what is still queued, unless carbon is unreachable, then close the connection
+        """
+        if self.is_alive():
+            self._stop_event.set()
+            try:
+                self.queue.put_nowait(_STOP)
+            except Queue.Full:
+                pass  # the shipper checks the stop event after each batch
+            self.join(timeout)
+
+    def run(self):
+        logger.info( "Thread started, carbon: %s:%d" % (self.server, self.port) )
+
+        stopping = False
+        while True:
+            if len(self.batch) == 0:
+                if stopping or (self._stop_event.is_set() and self.queue.empty()):
+                    break
+                line = self.queue.get()
+                if line == _STOP:
+                    break
+                self.batch.append(line)
+
+            # Take whatever else is already waiting
+            try:
+                while len(self.batch) < BATCH_SIZE:
+                    line = self.queue.get_nowait()
+                    if line == _STOP:
+                        stopping = True
+                        break
+                    self.batch.append(line)
+            except Queue.Empty:
+                pass
+
+            if self.send_batch():
+                continue
+
+            if self._stop_event.is_set():
+                self.dropped += len(self.batch) + self.queue.qsize()
+                break
+
+            self._stop_event.wait(self.backoff)
+            self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+
+        self.disconnect()
+        logger.info( "Thread stopped, %(sent)d metrics sent, %(dropped)d dropped" % self.get_stats() )
+
+    def send_batch(self):
+        try:
+            if self.sock is None:
+                self.sock = socket.create_connection((self.server, self.port), CONNECT_TIMEOUT)
+                self.sock.settimeout(SEND_TIMEOUT)
+                logger.info( "Connected to carbon" )
+
+            self.sock.sendall( "".join(self.batch) )
+
+        except (socket.error, socket.timeout) as e:
+            if self.sock is None:
+                self.connect_failures += 1
+                if self.connect_failures == 1 or self.backoff >= MAX_BACKOFF:
+                    logger.warning( "Could not connect to carbon at %s:%d: %s" % (self.server, self.port, str(e)) )
+            else:
+                logger.warning( "Lost connection to carbon: " + str(e) )
+            self.disconnect()
+            return False
 
-    sock = socket.socket()
+        self.sent += len(self.batch)
+        self.batch = []
+        self.backoff = MIN_BACKOFF
 
+        if self.dropped != self.reported_dropped:
+            logger.warning( "Dropped %d metrics while carbon was behind" % (self.dropped - self.reported_dropped) )
+            self.reported_dropped = self.dropped
+        return True
+
+    def disconnect(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+            self.sock = None
+
+
+_shipper = None
+_shipper_lock = Lock()
+
+
+def configure(server=CARBON_SERVER, port=CARBON_PORT, max_queue_size=MAX_QUEUE_SIZE):
+    """
+    Start the shared shipper, send_data starts one with the defaults if this was not called
+    """
+    global _shipper
+    _shipper_lock.acquire()
     try:
-        sock.connect((CARBON_SERVER, CARBON_PORT))
-        sock.sendall(message)
-        sock.close()
-    except socket.error:
-        pass
+        if _shipper is None:
+            _shipper = GraphiteShipper(server, port, max_queue_size)
+            _shipper.start()
     finally:
-        sock.close()
+        _shipper_lock.release()
+    return _shipper
+
+
+def get_shipper():
+    return _shipper
+
+
+def shutdown(timeout=None):
+    """
+    Send what is still queued and stop the shipper
+    """
+    global _shipper
+    _shipper_lock.acquire()
+    shipper = _shipper
+    _shipper = None
+    _shipper_lock.release()
+
+    if shipper is not None:
+        shipper.stop(timeout)
+
+
+def send_data(name, value):
+    """
+    Queue a metric for carbon, returns immediately whether or not carbon is up
+    """
+    shipper = _shipper
+    if shipper is None:
+        shipper = configure()
+    return shipper.put( '%s %s %d\n' % ( str(name), str(value), int(time.time()) ) )
+
+
+#
+# MAIN
+#
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.INFO)
+
+    #
+    # Test against a local TCP sink standing in for carbon
+    #
+    NUM_METRICS = 20000
+
+    def free_port():
+        s = socket.socket()
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+        s.close()
+        return port
+
+    class Sink(Thread):
+        def __init__(self, port):
+            Thread.__init__(self)
+            self.daemon = True
+            self.lines = 0
+            self.server = socket.socket()
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server.bind(("127.0.0.1", port))
+            self.server.listen(5)
+
+        def run(self):
+            while True:
+                (conn, _) = self.server.accept()
+                while True:
+                    content = conn.recv(65536)
+                    if not content:
+                        break
+                    self.lines += content.count("\n")
+                conn.close()
+
+    def timed_sends(count, prefix):
+        start = time.time()
+        for i in range(count):
+            send_data("%s.%d" % (prefix, i % 10), i)
+        return 1e6 * (time.time() - start) / count
+
+    # Carbon up: every metric arrives
+    port = free_port()
+    sink = Sink(port)
+    sink.start()
+    configure("127.0.0.1", port)
+    per_call = timed_sends(NUM_METRICS, "test.up")
+    shutdown()
+    time.sleep(0.2)
+    print "carbon up:   %.1f us per send_data, %d sent, %d received" % (per_call, NUM_METRICS, sink.lines)
+
+    # Carbon down: send_data does not wait, the overflow is dropped and counted,
+    # and what was queued is delivered once carbon comes back
+    port = free_port()
+    shipper = configure("127.0.0.1", port, max_queue_size=1000)
+    per_call = timed_sends(NUM_METRICS, "test.down")
+    print "carbon down: %.1f us per send_data, %s" % (per_call, shipper.get_stats())
+
+    sink = Sink(port)
+    sink.start()
+    time.sleep(2 * MIN_BACKOFF + 1)
+    print "carbon back: %s, %d received" % (shipper.get_stats(), sink.lines)
+    shutdown()
@@ -1,6 +1,9 @@
 
 import os
+import time
+import collections
 import logging
+import threading
 import traceback
 
 import config_utils
@@ -11,11 +14,25 @@ import comms_thread
 import spark_interface
 import twilio_interface
 import message_broadcast
+import web_server
+import control_handler
+import event_loop
+import scheduler
+import graphite_logging
+from data_logging import data_writer
 
 logger = logging.getLogger('allspark.object_group')
 
 CONFIG_SEC_NAME = "general"
 
+DEFAULT_WEB_PORT = 8080
+
+# Seconds between keepalive comments on the open /events connections
+EVENTS_KEEPALIVE_PERIOD = 15
+
+# Seconds to wait for all of the plugins to stop
+STOP_TIMEOUT = 10
+
 THIS_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PLUGINS_DIR = os.path.join( THIS_SCRIPT_DIR, "..", "plugins" )
 
@@ -35,6 +52,9 @@ class ObjectGroup:
 
         self._plugins = []
 
+        # (plugin name, method name) -> (plugin version, output), see render
+        self._render_cache = {}
+
         # Load helper objects
         # TODO: remove this somehow, possibly make them plugins also?
 
@@ -49,12 +69,57 @@ class ObjectGroup:
         if spark_auth_filename is None:
             return
 
-        self.spark = spark_interface.SparkInterface(spark_auth_filename)
+        spark_stream_events = False
+        if "spark_stream_events" in config.options(CONFIG_SEC_NAME):
+            spark_stream_events = config.get(CONFIG_SEC_NAME, "spark_stream_events").lower() == "true"
+
+        self.spark = spark_interface.SparkInterface(spark_auth_filename, stream_events=spark_stream_events)
 
         if not self.spark.is_initialized():
             logger.error( "Failed to create spark interface" )
             return
 
+        ############################################################################
+        # Event loop and scheduler
+        ############################################################################
+        self._event_loop = event_loop.EventLoop()
+        self.scheduler = scheduler.Scheduler(self._event_loop)
+
+        # Sockets and pipes are only moved to the event loop when asked to
+        self.event_loop = None
+        if "use_event_loop" in config.options(CONFIG_SEC_NAME) and \
+                config.get(CONFIG_SEC_NAME, "use_event_loop").lower() == "true":
+            self.event_loop = self._event_loop
+
+        ############################################################################
+        # Data logger write-behind
+        ############################################################################
+        if "data_write_behind" in config.options(CONFIG_SEC_NAME) and \
+                config.get(CONFIG_SEC_NAME, "data_write_behind").lower() == "true":
+
+            flush_interval = 5.0
+            if "data_flush_interval" in config.options(CONFIG_SEC_NAME):
+                flush_interval = float(config.get(CONFIG_SEC_NAME, "data_flush_interval"))
+
+            fsync_policy = data_writer.FSYNC_NEVER
+            if "data_fsync" in config.options(CONFIG_SEC_NAME):
+                fsync_policy = config.get(CONFIG_SEC_NAME, "data_fsync").lower()
+
+            data_writer.configure(flush_interval, fsync_policy)
+
+        ############################################################################
+        # Graphite
+        ############################################################################
+        carbon_server = graphite_logging.CARBON_SERVER
+        if "carbon_server" in config.options(CONFIG_SEC_NAME):
+            carbon_server = config.get(CONFIG_SEC_NAME, "carbon_server")
+
+        carbon_port = graphite_logging.CARBON_PORT
+        if "carbon_port" in config.options(CONFIG_SEC_NAME):
+            carbon_port = int(config.get(CONFIG_SEC_NAME, "carbon_port"))
+
+        graphite_logging.configure(carbon_server, carbon_port)
+
         ############################################################################
         # Comms Thread
         ############################################################################
@@ -64,6 +129,24 @@ class ObjectGroup:
             logger.error( "Failed to create comms thread" )
             return
 
+        ############################################################################
+        # Web Server
+        ############################################################################
+        self.web_port = DEFAULT_WEB_PORT
+        if "web_port" in config.options(CONFIG_SEC_NAME):
+            self.web_port = int(config.get(CONFIG_SEC_NAME, "web_port"))
+
+        self.web_server = web_server.WebServer(port = self.web_port)
+
+        if not self.web_server.is_initialized():
+            logger.warning( "Failed to create web server" )
+        else:
+            self.scheduler.schedule_periodic(EVENTS_KEEPALIVE_PERIOD, self.web_server.events.keepalive)
+
+        # Button presses on the page, sent to the same callbacks as the comms thread messages
+        self.control = control_handler.ControlHandler(self.comms, self.get_set_point_zones)
+        self.web_server.register_handler("/control", self.control.handle)
+
         ############################################################################
         # Twilio
         ############################################################################
@@ -86,28 +169,58 @@ class ObjectGroup:
         # Load all Plugin classes defined in the plugins directory
         ############################################################################
 
-        ordered_plugins = self.check_dependencies( plugin_classes )
+        ordered_plugins = get_plugin_order()
 
         if ordered_plugins is None:
             logger.error("DEPENDENCY ERROR")
             return
 
-        # Load each of the plugin classes
-        for (plugin_class_name, plugin_class_instance) in ordered_plugins:
+        # Load the plugins, each wave of plugins at the same time
+        if not self.load_plugins(config, ordered_plugins):
+            return
+
+        # Register the set_point callback
+        if hasattr(self, "set_point"):
+            set_p = getattr(self, "set_point")
+            if hasattr(set_p, "parse_set_point_message"):
+                self.comms.register_callback("set_point", set_p.parse_set_point_message)
+
+        # Register the alarm callback
+        if hasattr(self, "security_thread"):
+            sec_t = getattr(self, "security_thread")
+            if hasattr(sec_t, "parse_alarm_control_message"):
+                self.comms.register_callback("alarm", sec_t.parse_alarm_control_message)
+
+        # Register the zwave callback
+        if hasattr(self, "zwave_control"):
+            zwave_c = getattr(self, "zwave_control")
+            if hasattr(zwave_c, "parse_zwave_command_message"):
+                self.comms.register_callback("zwave", zwave_c.parse_zwave_command_message)
+
+        self._initialized = True
+
+    def load_plugins(self, config, ordered_plugins):
+        """
+        Create the plugins in waves: every plugin in a wave only depends on
+        plugins of earlier waves, so the plugins of a wave are created at the
+        same time, each on its own thread. A plugin that takes longer than its
+        get_init_timeout() to create is left out. Returns False on a fatal error.
+        """
+        startup = time.time()
+        timeline = []
+        loaded = {}  # class name -> plugin
+
+        for (wave_number, wave) in enumerate(self.get_init_waves(ordered_plugins)):
+
+            workers = []
+            for (plugin_class_name, plugin_class_instance) in wave:
 
-            try:
                 # Make sure its dependencies loaded ok
                 all_dependencies_met = True
                 for dependency in plugin_class_instance.get_dependencies():
-                    dependency_ok = False
-                    for loaded_plugin in self._plugins:
-                        if loaded_plugin.__class__.__name__ == dependency and \
-                                loaded_plugin.is_initialized() and \
-                                loaded_plugin.is_enabled():
-                            dependency_ok = True
-                            break
-
-                    if not dependency_ok:
+                    if dependency not in loaded or \
+                            not loaded[dependency].is_initialized() or \
+                            not loaded[dependency].is_enabled():
                         all_dependencies_met = False
                         break
 
@@ -116,7 +229,34 @@ class ObjectGroup:
                     continue
 
                 # Dependencies met, continue to load this plugin
-                plugin = plugin_class_instance( self, config )
+                result = {}
+                worker = threading.Thread(target=self.create_plugin,
+                                          args=(plugin_class_instance, config, result),
+                                          name="init_" + plugin_class_name)
+                worker.daemon = True
+                worker.start()
+                workers.append( (plugin_class_name, plugin_class_instance, worker, result, time.time()) )
+
+            for (plugin_class_name, plugin_class_instance, worker, result, started) in workers:
+
+                timeout = plugin_class_instance.get_init_timeout()
+                worker.join( max(0.0, started + timeout - time.time()) )
+
+                if worker.is_alive():
+                    logger.warning("Failed to load Plugin: " + plugin_class_name +
+                                   " not ready after " + str(timeout) + " seconds")
+                    timeline.append( (started - startup, timeout, wave_number, plugin_class_name, "timed out") )
+                    continue
+
+                timeline.append( (started - startup, result['end'] - started, wave_number, plugin_class_name,
+                                  result['status']) )
+
+                if 'error' in result:
+                    logger.error("Failed to load Plugin: " + plugin_class_name + "  " + str(result['error']))
+                    return False
+
+                plugin = result['plugin']
+                loaded[plugin_class_name] = plugin
 
                 # Add the plugin as an attribute to this class by name
                 setattr(self, plugin.get_name(), plugin)
@@ -127,35 +267,57 @@ class ObjectGroup:
                 # Report status
                 if plugin.is_initialized():
                     logger.info("Loaded Plugin: " + plugin.get_name())
+
+                    # Serve the plugins data at /data
+                    if hasattr(plugin, "data_logger"):
+                        self.web_server.register_data_logger(plugin.data_logger)
                 elif not plugin.is_enabled():
                     logger.info("Plugin disabled: " + plugin_class_name)
                 else:
                     logger.warning("Failed to load Plugin: " + plugin_class_name)
 
-            except TypeError as te:
-                traceback.print_exc()
-                logger.error("Failed to load Plugin: " + plugin_class_name + "  " + te.message)
-                return
-
-            # Register the set_point callback
-            if hasattr(self, "set_point"):
-                set_p = getattr(self, "set_point")
-                if hasattr(set_p, "parse_set_point_message"):
-                    self.comms.register_callback("set_point", set_p.parse_set_point_message)
-
-            # Register the alarm callback
-            if hasattr(self, "security_thread"):
-                sec_t = getattr(self, "security_thread")
-                if hasattr(sec_t, "parse_alarm_control_message"):
-                    self.comms.register_callback("alarm", sec_t.parse_alarm_control_message)
-
-            # Register the zwave callback
-            if hasattr(self, "zwave_control"):
-                zwave_c = getattr(self, "zwave_control")
-                if hasattr(zwave_c, "parse_zwave_command_message"):
-                    self.comms.register_callback("zwave", zwave_c.parse_zwave_command_message)
+        logger.info( "Startup timeline (%.1f seconds):" % (time.time() - startup) )
+        for (offset, duration, wave_number, plugin_class_name, status) in sorted(timeline):
+            logger.info( "  wave %d  %6.1f s + %6.1f s  %-30s %s" %
+                         (wave_number, offset, duration, plugin_class_name, status) )
+
+        return True
+
+    def create_plugin(self, plugin_class_instance, config, result):
+        try:
+            plugin = plugin_class_instance( self, config )
+            result['plugin'] = plugin
+            if plugin.is_initialized():
+                result['status'] = "loaded"
+            elif not plugin.is_enabled():
+                result['status'] = "disabled"
+            else:
+                result['status'] = "failed"
+        except Exception as e:
+            # Fatal, as it was when the plugins were created on the main thread
+            traceback.print_exc()
+            result['error'] = e
+            result['status'] = "error"
+        result['end'] = time.time()
 
-        self._initialized = True
+    @staticmethod
+    def get_init_waves(ordered_plugins):
+        """
+        Group dependency ordered plugins into waves, a plugin goes in the wave
+        after the last of its dependencies
+        """
+        wave_of = {}
+        waves = []
+        for (plugin_name, plugin_class) in ordered_plugins:
+            wave_number = 0
+            for dependency in plugin_class.get_dependencies():
+                wave_number = max(wave_number, wave_of[dependency] + 1)
+            wave_of[plugin_name] = wave_number
+
+            if wave_number == len(waves):
+                waves.append([])
+            waves[wave_number].append( (plugin_name, plugin_class) )
+        return waves
 
     def is_initialized(self):
         return self._initialized
@@ -166,80 +328,183 @@ class ObjectGroup:
     def get_plugins(self):
         return self._plugins
 
+    def get_set_point_zones(self):
+        """
+        The zones a set_point message is applied to, none until the set point plugin is loaded
+        """
+        set_p = getattr(self, "set_point", None)
+        if set_p is None or not set_p.is_initialized():
+            return []
+        return set_p.zones.keys()
+
     def start(self):
         if self.is_initialized() and not self.is_running():
+            self._event_loop.start()
+
             for plugin in self.get_plugins():
                 if plugin.is_initialized() and hasattr(plugin, 'start') and callable(getattr(plugin, 'start')):
                     plugin.start()
 
             self.comms.start()
+            self.spark.start()
+
+            if self.web_server.is_initialized():
+                self.web_server.start()
 
             self._running = True
 
     def stop(self):
         if self.is_initialized() and self.is_running():
+            # Tell every plugin to stop at once, then wait for them together
+            stopping = []
             for plugin in self.get_plugins():
-                if hasattr(plugin, 'stop') and callable(getattr(plugin, 'stop')):
-                    plugin.stop()
+                if hasattr(plugin, 'signal_stop') and callable(getattr(plugin, 'signal_stop')):
+                    plugin.signal_stop()
+                    stopping.append( (plugin, plugin.join_stop) )
+                elif hasattr(plugin, 'stop') and callable(getattr(plugin, 'stop')):
+                    # Plugins without a thread of their own may block in stop()
+                    stopper = threading.Thread(target=plugin.stop, name="stop_" + plugin.get_name())
+                    stopper.daemon = True
+                    stopper.start()
+                    stopping.append( (plugin, self.join_thread(stopper)) )
+
+            deadline = time.time() + STOP_TIMEOUT
+            for (plugin, join) in stopping:
+                if not join(max(0.0, deadline - time.time())):
+                    logger.warning( "Plugin did not stop within %d seconds: %s" % (STOP_TIMEOUT, plugin.get_name()) )
 
             self.comms.stop()
+            self.spark.stop(STOP_TIMEOUT)
+            self.web_server.stop()
+
+            self._event_loop.stop()
+
+            # Write out any data still queued by the loggers
+            data_writer.shutdown()
+
+            # Send the metrics still queued, without waiting long on an unreachable carbon
+            graphite_logging.shutdown(STOP_TIMEOUT)
 
             self._running = False
 
+    @staticmethod
+    def join_thread(thread):
+        def join(timeout):
+            thread.join(timeout)
+            return not thread.is_alive()
+        return join
+
     def get_javascript(self):
-        result = ""
+        # Where the page fetches data from, the page itself is served by a separate web server
+        result = [ """
+            var allspark_server = window.location.protocol + "//" + window.location.hostname + ":%d";
+
+            // Live updates of {element id: value} pushed by the plugins
+            if (window.EventSource)
+            {
+                var allspark_events = new EventSource(allspark_server + "/events");
+                allspark_events.addEventListener("update", function(event)
+                {
+                    var updates = JSON.parse(event.data);
+                    for (var id in updates)
+                    {
+                        var element = $("#" + id);
+                        var value = updates[id];
+                        if (typeof value === "string")
+                        {
+                            element.text(value);
+                            continue;
+                        }
+                        if ("text" in value)
+                            element.text(value.text);
+                        if ("html" in value)
+                            element.html(value.html);
+                        if ("class" in value)
+                            element.attr("class", value["class"]);
+                    }
+                });
+            }
+            """ % self.web_port ]
         for plugin in self.get_plugins():
             if hasattr(plugin, 'get_javascript') and callable(getattr(plugin, 'get_javascript')):
-                result += plugin.get_javascript()
-        return result
+                result.append( self.render(plugin, "get_javascript") )
+        return "".join(result)
 
     def get_html(self):
-        result = ""
+        result = []
         for plugin in self.get_plugins():
             if hasattr(plugin, 'get_html') and callable(getattr(plugin, 'get_html')):
-                result += plugin.get_html()
-        return result
+                result.append( self.render(plugin, "get_html") )
+        return "".join(result)
+
+    def render(self, plugin, method_name):
+        """
+        Output of a plugins get_html or get_javascript, reused while the plugins
+        version (see Plugin.get_version) stays the same
+        """
+        version = None
+        if plugin.is_initialized() and hasattr(plugin, 'get_version'):
+            version = plugin.get_version()
+
+        key = (plugin.get_name(), method_name)
+        if version is not None:
+            cached = self._render_cache.get(key)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+
+        content = getattr(plugin, method_name)()
+        if version is not None:
+            self._render_cache[key] = (version, content)
+        return content
 
     @staticmethod
     def check_dependencies(classes_to_sort):
-
-        num_classes = len(classes_to_sort)
-        ordered_classes = []
-
-        # First pass, add plugins with no dependencies
+        """
+        Order (name, class) pairs so that every plugin comes after the plugins it
+        depends on (Kahn's algorithm). Returns None, after logging why, if a
+        dependency is not one of the classes or the dependencies form a cycle.
+        """
+        classes = {}
+        dependents = {}
+        num_dependencies = {}
         for plugin_name, plugin_class in classes_to_sort:
-            if len(plugin_class.get_dependencies()) == 0:
-                ordered_classes.append( (plugin_name, plugin_class) )
-                logger.debug( "P0: " + plugin_name + " " + str( plugin_class.get_dependencies() ) )
-
-        # Remaining passes, determine the order of the remaining classes
-        num_classes_remaining = num_classes - len(ordered_classes)
-        for pass_num in range(num_classes_remaining):
-            for plugin_name, plugin_class in classes_to_sort:
+            classes[plugin_name] = plugin_class
+            dependents[plugin_name] = []
 
-                # skip the already sorted items
-                if (plugin_name, plugin_class) in ordered_classes:
-                    continue
+        dependencies_found = True
+        for plugin_name, plugin_class in classes_to_sort:
+            dependencies = set(plugin_class.get_dependencies())
+            for dependency in dependencies:
+                if dependency not in classes:
+                    logger.error( "Plugin " + plugin_name + " depends on unknown plugin: " + dependency )
+                    dependencies_found = False
+                else:
+                    dependents[dependency].append(plugin_name)
+            num_dependencies[plugin_name] = len(dependencies)
 
-                dependencies = plugin_class.get_dependencies()
+        if not dependencies_found:
+            return None
 
-                dependencies_met = True
-                for dependency in dependencies:
-                    if dependency not in [ c for (c, _) in ordered_classes ]:
-                        dependencies_met = False
-                        break
+        # Start with the plugins that have no dependencies, in the order given
+        ready = collections.deque([ name for (name, _) in classes_to_sort if num_dependencies[name] == 0 ])
+        ordered_classes = []
+        while len(ready) > 0:
+            plugin_name = ready.popleft()
+            ordered_classes.append( (plugin_name, classes[plugin_name]) )
+            logger.debug( "P" + str(len(ordered_classes)) + ": " + plugin_name + " " +
+                          str( classes[plugin_name].get_dependencies() ) )
 
-                if dependencies_met:
-                    ordered_classes.append( (plugin_name, plugin_class) )
-                    logger.debug( "P" + str(pass_num + 1) + ": " +
-                                  plugin_name + " " +
-                                  str( plugin_class.get_dependencies() ))
+            for dependent in dependents[plugin_name]:
+                num_dependencies[dependent] -= 1
+                if num_dependencies[dependent] == 0:
+                    ready.append(dependent)
 
-                if len(ordered_classes) == len(classes_to_sort):
-                    return ordered_classes
+        if len(ordered_classes) != len(classes):
+            cycle = sorted([ name for name in num_dependencies if num_dependencies[name] > 0 ])
+            logger.error( "Dependency cycle between plugins: " + ", ".join(cycle) )
+            return None
 
-        if len(ordered_classes) != len(classes_to_sort):
-            return []
+        return ordered_classes
 
     @staticmethod
     def get_template_config(config):
@@ -249,6 +514,19 @@ class ObjectGroup:
         return config
 
 
+_plugin_order = None
+
+
+def get_plugin_order():
+    """
+    The plugin classes in dependency order, sorted once per process
+    """
+    global _plugin_order
+    if _plugin_order is None:
+        _plugin_order = ObjectGroup.check_dependencies( plugin_classes )
+    return _plugin_order
+
+
 if __name__ == '__main__':
     import ConfigParser
 
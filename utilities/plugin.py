@@ -2,6 +2,8 @@
 import logging
 from utilities import config_utils
 
+DEFAULT_INIT_TIMEOUT = 60
+
 
 class Plugin:
     def __init__(self, plugin_name, config=None, object_group=None):
@@ -14,6 +16,9 @@ class Plugin:
         # Modified in config
         self._enabled = True
 
+        # Bumped when what the plugin shows on the page changes, see get_version
+        self._version = 0
+
         if config is not None:
             self.verify_common_plugin_config_items()
 
@@ -38,7 +43,32 @@ class Plugin:
     def get_name(self):
         return self.name
 
+    def get_version(self):
+        """
+        A value that changes whenever get_html or get_javascript would return
+        something different, so the page can reuse the last output while it is
+        the same. None (the default) means the output is rebuilt every time.
+        """
+        return None
+
+    def bump_version(self):
+        self._version += 1
+
+    def publish_update(self, updates):
+        """
+        Send {element id: value} to the open pages, a string value replaces the
+        text of the element and a dictionary can set its "text", "html" or "class"
+        """
+        web = getattr(self.og, "web_server", None)
+        if web is not None and web.is_initialized():
+            web.events.publish(updates)
+
     # Must be overridden!
     @staticmethod
     def get_dependencies():
         raise NotImplementedError
+
+    # Seconds the plugin may take to be created before startup goes on without it
+    @staticmethod
+    def get_init_timeout():
+        return DEFAULT_INIT_TIMEOUT
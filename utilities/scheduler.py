@@ -0,0 +1,109 @@
+#! /usr/bin/env python
+
+import time
+import random
+import logging
+from threading import Lock
+
+logger = logging.getLogger('allspark.scheduler')
+
+
+class Job:
+    """
+    A periodic job, returned by Scheduler.schedule_periodic
+    """
+
+    def __init__(self, scheduler, period, func, jitter):
+        self.scheduler = scheduler
+        self.period = period
+        self.func = func
+        self.jitter = jitter
+        self.next_time = None
+        self.timer = None
+        self.cancelled = False
+        self.lock = Lock()
+
+    def cancel(self):
+        """
+        Stop the job, it will not run again even if its timer is already due
+        """
+        self.lock.acquire()
+        self.cancelled = True
+        if self.timer is not None:
+            self.timer.cancel()
+        self.lock.release()
+
+
+class Scheduler:
+    """
+    Periodic jobs for the whole daemon on the timers of one event loop, instead
+    of every plugin waking up each second to check if it is time to run.
+    Job functions are called on the event loop thread and must not block, the
+    usual job just wakes up the thread that does the work.
+    """
+
+    def __init__(self, event_loop):
+        self.event_loop = event_loop
+
+    def schedule_periodic(self, period, func, jitter=0.0, first_delay=None):
+        """
+        Call func() every period seconds, starting after first_delay (default: one
+        period). Each run is delayed by a random 0 to jitter seconds, so jobs
+        with the same period do not all fire at once. Runs are kept on the
+        original period however late the previous run was, and runs missed
+        entirely are skipped.
+        """
+        job = Job(self, period, func, jitter)
+        job.next_time = time.time() + (period if first_delay is None else first_delay)
+        self.arm(job)
+        return job
+
+    def arm(self, job):
+        job.lock.acquire()
+        if not job.cancelled:
+            job.timer = self.event_loop.call_at(job.next_time + random.uniform(0, job.jitter), self.fire, job)
+        job.lock.release()
+
+    def fire(self, job):
+        if job.cancelled:
+            return
+
+        try:
+            job.func()
+        finally:
+            # Drift correction: the next run is a whole number of periods after
+            # the first, not a period after this run happened to fire
+            now = time.time()
+            job.next_time += job.period
+            if job.next_time <= now:
+                missed = int((now - job.next_time) / job.period) + 1
+                logger.debug( "Skipping %d missed runs of %s" % (missed, getattr(job.func, "__name__", "job")) )
+                job.next_time += missed * job.period
+            self.arm(job)
+
+
+#
+# MAIN
+#
+if __name__ == "__main__":
+    import event_loop
+
+    loop = event_loop.EventLoop()
+    loop.start()
+    scheduler = Scheduler(loop)
+
+    start = time.time()
+
+    def report(name):
+        print "%-6s %.3f" % (name, time.time() - start)
+
+    fast = scheduler.schedule_periodic(0.2, lambda: report("fast"))
+    slow = scheduler.schedule_periodic(0.5, lambda: report("slow"), jitter=0.05)
+
+    time.sleep(1.1)
+    fast.cancel()
+    slow.cancel()
+    print "cancelled"
+    time.sleep(0.5)
+
+    loop.stop()
@@ -1,20 +1,83 @@
 
 from datetime import datetime
 import os
+import sys
+import json
+import time
 import requests
 import logging
-from threading import Lock
+import Queue
+from threading import Thread, Lock, Event
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
 base_url = 'https://api.spark.io/v1/'
+oauth_url = 'https://api.spark.io/oauth/token'
+
+# Maximum number of concurrent requests made by get_variables
+MAX_WORKERS = 8
+
+# (connect, read) timeout in seconds applied to every request
+REQUEST_TIMEOUT = (5.0, 15.0)
+
+# Retries for failed connections and server errors, waiting
+# BACKOFF_FACTOR * (2 ^ retry number) seconds between attempts
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+
+# Seconds between checks of the cloud for added or removed devices
+DEVICE_REFRESH_PERIOD = 600
+
+# Seconds stop() waits for the background threads
+STOP_TIMEOUT = 10
+
+# Seconds before its expiry that a token is replaced by a new one
+TOKEN_EXPIRY_MARGIN = 86400
+
+# Seconds a cached device list is used at startup before it is fetched again
+DEVICE_CACHE_MAX_AGE = 86400
+
+# Read timeout of the event stream connection, the cloud sends keep-alives more often than this
+STREAM_READ_TIMEOUT = 90.0
+
+# Seconds to wait before reconnecting a dropped event stream
+STREAM_RETRY_DELAY = 10
+
+# Seconds a value received from the event stream is considered current
+STREAM_MAX_AGE = 180
+
+# Device name groups that are looked up often, precomputed whenever the device list changes
+KNOWN_POSTFIXES = ["_floor_temp"]
 
 logger = logging.getLogger('allspark.spark_interface')
 
 
 class SparkInterface:
-    def __init__(self, auth_filename = "spark_auth.txt"):
+    def __init__(self, auth_filename = "spark_auth.txt", stream_events = False):
 
         self._initialized = False
-        self.mutex = Lock()
+        self._running = False
+        self._stop_event = Event()
+        self.stream_events = stream_events
+        self.stream_response = None
+        self.index_lock = Lock()
+        self.devices = {}
+        self.device_ids = {}
+        self.device_names = []
+        self.device_groups = {}
+
+        # Last value published by each device: (device name, event name) -> (value, time received)
+        self.last_values = {}
+
+        # One session for all requests so connections to the cloud are kept alive
+        # and reused, with enough pooled connections for every get_variables worker
+        self.session = requests.Session()
+        retries = Retry(total=MAX_RETRIES,
+                        backoff_factor=BACKOFF_FACTOR,
+                        status_forcelist=[500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS, max_retries=retries)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         
         if not os.access(auth_filename, os.R_OK):
             logger.error( "Error: failure to read auth file (" + auth_filename +
@@ -31,20 +94,126 @@ class SparkInterface:
                           "). Must contain 'username:password'" )
             return
         
-        username = auth[0]
-        password = auth[1]
+        self.username = auth[0]
+        self.password = auth[1]
+        
+        self.access_token = None
+        self.token_expires_at = 0.0
+        self.devices_expire_at = 0.0
+        self.cache_filename = auth_filename + ".cache"
+        
+        if self.load_cache():
+            # Serve from the cached token and devices right away, check them with the cloud in the background
+            logger.info( "Using cached token and device list" )
+            self.bootstrap_thread = Thread(target=self.bootstrap, name="spark_bootstrap")
+            self.bootstrap_thread.daemon = True
+            self.bootstrap_thread.start()
+        
+        elif not self.bootstrap():
+            return
+        
+        for device in self.device_names:
+            logger.info( "Found particle device:" + device )
+        
+        self._initialized = True
+    
+    def is_initialized(self):
+        return self._initialized
+
+    def load_cache(self):
+        """
+        Load the access token and device list saved by the last run. Returns
+        False if there is no cache or the cached token has expired. A token
+        that expires soon and a stale device list are still used, the
+        bootstrap thread replaces them.
+        """
+        if not os.path.isfile(self.cache_filename):
+            return False
+        
+        try:
+            f = open(self.cache_filename, 'r')
+            cache = json.load(f)
+            f.close()
+            
+            token_expires_at = float(cache['token_expires_at'])
+            devices_expire_at = float(cache['devices_expire_at'])
+            device_list = [ (name, device_id) for (name, device_id) in cache['devices'] ]
+            token = str(cache['token'])
+        except (IOError, ValueError, KeyError, TypeError):
+            logger.warning( "Ignoring unreadable cache file: " + self.cache_filename )
+            return False
+        
+        if token_expires_at < time.time():
+            logger.info( "Cached token has expired" )
+            return False
+        
+        self.set_token(token, token_expires_at)
+        
+        if devices_expire_at < time.time():
+            logger.info( "Cached device list is stale, using it until it is fetched again" )
+        
+        self.devices_expire_at = devices_expire_at
+        self.index_devices(device_list)
+        return True
+    
+    def save_cache(self):
+        cache = {'token': self.access_token[len("?access_token="):],
+                 'token_expires_at': self.token_expires_at,
+                 'devices': [ (name, self.devices[name]) for name in self.device_names ],
+                 'devices_expire_at': self.devices_expire_at}
+        
+        # Write a private temp file and rename it so a crash never leaves a partial cache
+        temp_filename = self.cache_filename + ".tmp"
+        try:
+            fd = os.open(temp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+            f = os.fdopen(fd, 'w')
+            json.dump(cache, f)
+            f.close()
+            os.rename(temp_filename, self.cache_filename)
+        except (IOError, OSError):
+            logger.warning( "Could not write cache file: " + self.cache_filename + " " + repr(sys.exc_info()[1]) )
+    
+    def set_token(self, token, expires_at):
+        self.access_token = "?access_token=" + token
+        self.token_expires_at = expires_at
+    
+    def bootstrap(self):
+        """
+        Get a valid access token (deleting expired ones and creating a new one
+        if needed), then the device list, and save both to the cache file.
+        """
+        try:
+            token = self.request_token()
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError):
+            logger.error( "Error: Could not get token: " + repr(sys.exc_info()[1]) )
+            return False
+        
+        if token is None:
+            return False
+        
+        device_list = self.fetch_devices()
+        if device_list is not None:
+            self.devices_expire_at = time.time() + DEVICE_CACHE_MAX_AGE
+            self.index_devices(device_list)
+        
+        self.save_cache()
+        return True
+    
+    def request_token(self):
+        auth = (self.username, self.password)
         
-        r = requests.get(base_url + "access_tokens", auth=(username, password))
+        r = self.session.get(base_url + "access_tokens", auth=auth, timeout=REQUEST_TIMEOUT)
         
         if r.status_code != 200:
             logger.error( "Error: Could not get token." )
-            return
+            return None
         
         j = r.json()
         
         now = datetime.now()
         
         token = None
+        token_expires_at = 0.0
         for token_data in j:
             if ('expires_at' in token_data) and \
                (token_data['expires_at'] is not None) and \
@@ -54,48 +223,257 @@ class SparkInterface:
                 expires = datetime.strptime(token_data['expires_at'][0:-5], "%Y-%m-%dT%H:%M:%S")
                 if expires < now:
                     # delete
-                    r = requests.delete(base_url + "access_tokens/" + token_data['token'], auth=(username, password))
+                    r = self.session.delete(base_url + "access_tokens/" + token_data['token'],
+                                            auth=auth,
+                                            timeout=REQUEST_TIMEOUT)
                     if r.status_code != 200:
                         logger.warning( "Warning: Could not delete token (" + token_data['token'] + "): " + r.reason )
                 else:
-                    token = token_data['token']
+                    expires_at = time.mktime(expires.timetuple())
+                    if expires_at > token_expires_at:
+                        token = token_data['token']
+                        token_expires_at = expires_at
         
-        if token is None:
+        # Tokens that are about to expire are left to be deleted once they have
+        if token is None or token_expires_at < time.time() + TOKEN_EXPIRY_MARGIN:
             # create new token
-            r = requests.post("https://api.spark.io/oauth/token", data={'grant_type': 'password',
-                                                                        'username': username,
-                                                                        'password': password},
-                              auth=('spark', 'spark'))
+            r = self.session.post(oauth_url, data={'grant_type': 'password',
+                                                   'username': self.username,
+                                                   'password': self.password},
+                                  auth=('spark', 'spark'),
+                                  timeout=REQUEST_TIMEOUT)
 
             if r.status_code != 200:
                 logger.warning( "Warning: Could not create token: " + r.reason )
-                return
+                if token is None:
+                    return None
+                # Keep using the old token until it expires, creating one is tried again on the next refresh
+                self.set_token(token, token_expires_at)
+                return token
             token = r.json()['access_token']
+            token_expires_at = time.time() + float(r.json().get('expires_in', 0))
         
-        self.access_token = "?access_token=" + token
-    
-        r = requests.get(base_url + "devices" + self.access_token)
+        self.set_token(token, token_expires_at)
+        return token
+
+    def start(self):
+        if self._initialized and not self._running:
+            self._running = True
+            self._stop_event.clear()
+            self.refresh_thread = Thread(target=self.refresh_loop, name="spark_refresh")
+            self.refresh_thread.daemon = True
+            self.refresh_thread.start()
+
+            if self.stream_events:
+                self.stream_thread = Thread(target=self.stream_loop, name="spark_stream")
+                self.stream_thread.daemon = True
+                self.stream_thread.start()
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """
+        Stop the background threads, returns False if they did not stop within
+        timeout seconds. They are daemon threads, one stuck in a request does
+        not keep the process alive.
+        """
+        if not self._running:
+            return True
+
+        self._running = False
+        self._stop_event.set()
+        deadline = time.time() + timeout
+
+        threads = [self.refresh_thread]
+        if self.stream_events:
+            # Closing the response unblocks the stream thread if it is waiting for an event
+            response = self.stream_response
+            if response is not None:
+                response.close()
+            threads.append(self.stream_thread)
+
+        stopped = True
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.time()))
+            if thread.is_alive():
+                logger.warning( "Thread did not stop within %d seconds: %s" % (timeout, thread.name) )
+                stopped = False
+        return stopped
+
+    def refresh_loop(self):
+        logger.info( "Device refresh thread started" )
+        while self._running:
+            self._stop_event.wait(DEVICE_REFRESH_PERIOD)
+            if self._running:
+                # Keep the thread alive through anything the cloud sends back, the next refresh tries again
+                try:
+                    if self.token_expires_at < time.time() + TOKEN_EXPIRY_MARGIN:
+                        self.bootstrap()
+                    else:
+                        self.refresh_devices()
+                except Exception:
+                    logger.exception( "Device refresh failed" )
+        logger.info( "Device refresh thread stopped" )
+
+    def stream_loop(self):
+        logger.info( "Event stream thread started" )
+        while self._running:
+            try:
+                self.read_event_stream()
+            except Exception:
+                if self._running:
+                    logger.warning( "Event stream error: " + repr(sys.exc_info()[1]) )
+
+            # Wait before reconnecting
+            self._stop_event.wait(STREAM_RETRY_DELAY)
+        logger.info( "Event stream thread stopped" )
+
+    def read_event_stream(self):
+        """
+        Subscribe to the Server-Sent-Events stream of the events published by
+        the devices on this account, and record the latest value of each one.
+        Returns when the connection is closed.
+        """
+        r = self.session.get(base_url + "devices/events" + self.access_token,
+                             stream=True,
+                             timeout=(REQUEST_TIMEOUT[0], STREAM_READ_TIMEOUT))
+        if r.status_code != 200:
+            logger.warning( "Could not open event stream: " + r.reason )
+            r.close()
+            return
+
+        self.stream_response = r
+        logger.info( "Event stream connected" )
+
+        event_name = None
+        for line in r.iter_lines(chunk_size=1):
+            if not self._running:
+                break
+
+            # Blank lines end an event, lines starting with ':' are keep-alive comments
+            if not line or line.startswith(':'):
+                if not line:
+                    event_name = None
+                continue
+
+            field, _, value = line.partition(':')
+            value = value.lstrip()
+
+            if field == 'event':
+                event_name = value
+            elif field == 'data' and event_name is not None:
+                self.parse_event(event_name, value)
+
+        self.stream_response = None
+        r.close()
+
+    def parse_event(self, event_name, data):
+        try:
+            event = json.loads(data)
+            device_name = self.device_ids.get(event['coreid'])
+            value = event['data']
+        except (ValueError, KeyError, TypeError):
+            logger.warning( "Could not parse event '" + event_name + "': " + data )
+            return
+
+        if device_name is None:
+            logger.debug( "Event '" + event_name + "' from unknown device: " + str(event.get('coreid')) )
+            return
+
+        self.last_values[(device_name, event_name)] = (value, time.time())
+
+    def get_cached_variable(self, device_name, variable, max_age=STREAM_MAX_AGE):
+        """
+        Get the last value the device published for this variable over the event
+        stream, or None if it is older than max_age seconds or was never received.
+        """
+        if not self._initialized or not self.stream_events:
+            return None
+
+        entry = self.last_values.get( (device_name, variable) )
+        if entry is None:
+            return None
+
+        (value, received) = entry
+        if time.time() - received > max_age:
+            return None
+
+        return value
+
+    def fetch_devices(self):
+        """
+        Get the list of (name, id) tuples for the devices on this account, or
+        None if the cloud could not be reached.
+        """
+        try:
+            r = self.session.get(base_url + "devices" + self.access_token, timeout=REQUEST_TIMEOUT)
+        except requests.exceptions.RequestException:
+            logger.error( "Could not get devices: " + repr(sys.exc_info()[1]) )
+            return None
         
         if r.status_code != 200:
             logger.error( "Could not get devices: " + r.reason )
-            self.devices = []
+            return None
         
-        self.devices = [ (x['name'], x['id']) for x in r.json() ]
-        
-        for device in [ n[0] for n in self.devices ]:
-            logger.info( "Found particle device:" + device )
-        
-        self._initialized = True
-    
-    def is_initialized(self):
-        return self._initialized
+        try:
+            return [ (x['name'], x['id']) for x in r.json() ]
+        except (ValueError, KeyError, TypeError):
+            logger.error( "Could not parse the device list: " + repr(sys.exc_info()[1]) )
+            return None
+
+    def index_devices(self, device_list):
+        """
+        Build the device lookup tables from a list of (name, id) tuples. The
+        tables are replaced as a whole so readers never see a partial update.
+        """
+        devices = {}
+        device_ids = {}
+        device_names = []
+        for (name, device_id) in device_list:
+            if name is None:
+                continue
+            devices[name] = device_id
+            device_ids[device_id] = name
+            device_names.append(name)
+
+        groups = {}
+        for postfix in KNOWN_POSTFIXES:
+            groups[postfix] = [ n for n in device_names if n.endswith(postfix) ]
+
+        self.index_lock.acquire()
+        self.devices = devices
+        self.device_ids = device_ids
+        self.device_names = device_names
+        self.device_groups = groups
+        self.index_lock.release()
+
+    def refresh_devices(self):
+        device_list = self.fetch_devices()
+        if device_list is None:
+            return
+
+        old_names = set(self.device_names)
+        self.devices_expire_at = time.time() + DEVICE_CACHE_MAX_AGE
+        self.index_devices(device_list)
+        self.save_cache()
+
+        for device in self.device_names:
+            if device not in old_names:
+                logger.info( "Found new particle device:" + device )
+        for device in old_names:
+            if device not in self.devices:
+                logger.info( "Particle device removed:" + device )
         
     def get_device_names(self, postfix=None):
         if self._initialized:
             if postfix is None:
-                return [ n[0] for n in self.devices ]
-            else:
-                return [ n[0] for n in self.devices if n[0].endswith(postfix) ]
+                return list(self.device_names)
+
+            self.index_lock.acquire()
+            if postfix not in self.device_groups:
+                self.device_groups[postfix] = [ n for n in self.device_names if n.endswith(postfix) ]
+            group = self.device_groups[postfix]
+            self.index_lock.release()
+
+            return list(group)
         
     def get_pretty_device_names(self, postfix=None):
         if self._initialized:
@@ -103,21 +481,20 @@ class SparkInterface:
             if postfix is None:
                 return devs
             else:
-                return [ n[0].replace(postfix, '') for n in devs ]
+                return [ n.replace(postfix, '') for n in devs ]
     
     def get_variable(self, device_name, variable):
         if self._initialized:
         
-            if device_name not in [ n[0] for n in self.devices ]:
+            device_id = self.devices.get(device_name)
+            if device_id is None:
                 logger.warning( "Error: requested device name (" + device_name + ") not found" )
                 return None
             
-            device_id = [ n[1] for n in self.devices if n[0] == device_name ]
-            
-            self.mutex.acquire()
             result = None
             try:
-                r = requests.get(base_url + "devices/" + device_id[0] + "/" + variable + self.access_token)
+                r = self.session.get(base_url + "devices/" + device_id + "/" + variable + self.access_token,
+                                     timeout=REQUEST_TIMEOUT)
                 
                 if r.status_code == 200:
                     result = r.json()['result']
@@ -127,14 +504,303 @@ class SparkInterface:
             except requests.exceptions.RequestException:
                 pass
             
-            self.mutex.release()
-            
             return result
 
-if __name__ == "__main__":    
-    s = SparkInterface("data/spark_auth.txt")
-    devNames = s.get_device_names(postfix="_floor_temp")
-    for d in devNames:
-        print d, ":", s.get_variable(d, "temperature")
-    
-    print "Security status:", s.get_variable("security", "state")
+    def get_variables(self, device_variables, max_workers=MAX_WORKERS):
+        """
+        Read several (device_name, variable) pairs concurrently. Returns a list
+        of results in the same order as the request, None for failed reads.
+        """
+        if not self._initialized:
+            return None
+
+        results = [None] * len(device_variables)
+
+        work = Queue.Queue()
+        for index, (device_name, variable) in enumerate(device_variables):
+            work.put( (index, device_name, variable) )
+
+        def worker():
+            while True:
+                try:
+                    (i, dev, var) = work.get_nowait()
+                except Queue.Empty:
+                    return
+                results[i] = self.get_variable(dev, var)
+
+        workers = []
+        for _ in range( min(max_workers, len(device_variables)) ):
+            t = Thread(target=worker, name="spark_worker")
+            t.daemon = True
+            t.start()
+            workers.append(t)
+
+        for t in workers:
+            t.join()
+
+        return results
+
+#
+# MAIN
+#
+if __name__ == "__main__":
+    import socket
+    import tempfile
+    import urlparse
+    from SocketServer import ThreadingMixIn
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+    #
+    # python spark_interface.py                 read the real devices in data/spark_auth.txt
+    # python spark_interface.py concurrent      benchmark get_variables against a fake Particle cloud
+    # python spark_interface.py session         benchmark new connections against the pooled session
+    # python spark_interface.py startup         time startup with and without the cache file
+    # python spark_interface.py stream          follow the event stream of a local SSE stub
+    #
+    NUM_FAKE_DEVICES = 8
+    FAKE_DEVICE_DELAY = 0.2  # seconds the fake cloud takes to read a variable
+    NUM_SESSION_REQUESTS = 1000
+    FAKE_CLOUD_LATENCY = 0.3  # seconds the fake cloud takes to answer anything, for the startup benchmark
+    FAKE_EVENT_PERIOD = 0.05  # seconds between the events the fake devices publish
+    STREAM_TEST_TIME = 2.0
+
+    class FakeParticleHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        # Whole responses in one packet, as the cloud sends them
+        wbufsize = -1
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            path = urlparse.urlparse(self.path).path
+            self.server.requests += 1
+            time.sleep(self.server.latency)
+
+            if path == "/v1/devices/events":
+                self.send_events()
+            elif path == "/v1/access_tokens":
+                self.send_json([ {"token": token, "client": "spark-cli",
+                                  "expires_at": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.localtime(expires_at))}
+                                 for (token, expires_at) in self.server.tokens ])
+            elif path == "/v1/devices":
+                self.send_json([ {"name": name, "id": device_id} for (name, device_id) in self.server.devices ])
+            elif path.startswith("/v1/devices/"):
+                time.sleep(self.server.delay)
+                self.send_json({"result": 70.5})
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.getheader("Content-Length", 0)))
+            self.server.requests += 1
+            time.sleep(self.server.latency)
+
+            if urlparse.urlparse(self.path).path == "/oauth/token":
+                token = "fake_token_%d" % len(self.server.tokens)
+                self.server.tokens.append( (token, time.time() + 90 * 86400) )
+                self.send_json({"access_token": token, "expires_in": 90 * 86400})
+            else:
+                self.send_error(404)
+
+        def send_events(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+
+            # Each device publishes its temperature in turn, with a keep-alive comment after each round
+            count = 0
+            while self.server.streaming:
+                for (_, device_id) in self.server.devices:
+                    count += 1
+                    event = {"coreid": device_id, "data": "%.1f" % (60 + count % 200 / 10.0),
+                             "published_at": time.strftime("%Y-%m-%dT%H:%M:%S.000Z")}
+                    self.wfile.write("event: temperature\ndata: %s\n\n" % json.dumps(event))
+                    self.wfile.flush()
+                    self.server.events += 1
+                    time.sleep(FAKE_EVENT_PERIOD)
+                self.wfile.write(":\n")
+                self.wfile.flush()
+
+        def send_json(self, obj):
+            content = json.dumps(obj)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def handle(self):
+            try:
+                BaseHTTPRequestHandler.handle(self)
+            except socket.error:
+                pass  # the client went away
+
+        def finish(self):
+            try:
+                BaseHTTPRequestHandler.finish(self)
+            except socket.error:
+                pass
+
+        def log_message(self, format_str, *args):
+            pass
+
+    class FakeParticleServer(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+        def __init__(self, num_devices, delay, latency=0.0, token_lifetime=30 * 86400):
+            HTTPServer.__init__(self, ("127.0.0.1", 0), FakeParticleHandler)
+            self.devices = [ ("zone%d_floor_temp" % i, "id%d" % i) for i in range(num_devices) ]
+            self.tokens = [ ("fake_token", time.time() + token_lifetime) ]
+            self.delay = delay
+            self.latency = latency
+            self.requests = 0
+            self.events = 0
+            self.streaming = True
+            server_thread = Thread(target=self.serve_forever)
+            server_thread.daemon = True
+            server_thread.start()
+
+        def stop(self, spark):
+            # Closing the client's connections ends the kept-alive handler threads
+            self.streaming = False
+            spark.session.close()
+            self.shutdown()
+            self.server_close()
+            time.sleep(0.1)
+
+    def fake_spark_interface(server, auth_filename=None, **kwargs):
+        global base_url, oauth_url
+        base_url = "http://127.0.0.1:%d/v1/" % server.server_address[1]
+        oauth_url = "http://127.0.0.1:%d/oauth/token" % server.server_address[1]
+
+        if auth_filename is None:
+            auth_filename = os.path.join(tempfile.mkdtemp(), "spark_auth.txt")
+            f = open(auth_filename, 'w')
+            f.write("user:password")
+            f.close()
+        return SparkInterface(auth_filename, **kwargs)
+
+    def benchmark_concurrent():
+        server = FakeParticleServer(NUM_FAKE_DEVICES, FAKE_DEVICE_DELAY)
+        s = fake_spark_interface(server)
+        reads = [ (d, "temperature") for d in s.get_device_names(postfix="_floor_temp") ]
+
+        start = time.time()
+        sequential = [ s.get_variable(d, v) for (d, v) in reads ]
+        sequential_time = time.time() - start
+
+        start = time.time()
+        concurrent = s.get_variables(reads)
+        concurrent_time = time.time() - start
+
+        print "%d devices, %.1f s per read" % (len(reads), FAKE_DEVICE_DELAY)
+        print "one at a time:  %.2f s" % sequential_time
+        print "get_variables:  %.2f s" % concurrent_time
+        server.stop(s)
+        if concurrent != sequential:
+            print "FAILED: the results differ"
+            sys.exit(1)
+
+    def benchmark_session():
+        server = FakeParticleServer(1, 0.0)
+        s = fake_spark_interface(server)
+        url = base_url + "devices/id0/temperature" + s.access_token
+
+        def report(name, get):
+            latencies = []
+            start = time.time()
+            for _ in range(NUM_SESSION_REQUESTS):
+                t = time.time()
+                get(url, timeout=REQUEST_TIMEOUT).json()
+                latencies.append(time.time() - t)
+            total = time.time() - start
+
+            latencies.sort()
+            print "%-28s %7.1f requests/s  p50 %6.2f ms  p99 %6.2f ms" % \
+                (name, NUM_SESSION_REQUESTS / total,
+                 1000 * latencies[NUM_SESSION_REQUESTS / 2], 1000 * latencies[int(0.99 * NUM_SESSION_REQUESTS)])
+
+        report("new connection per request", requests.get)
+        report("pooled session", s.session.get)
+        server.stop(s)
+
+    def benchmark_startup():
+        # The account's only token expires within TOKEN_EXPIRY_MARGIN, so a new one must be created
+        server = FakeParticleServer(NUM_FAKE_DEVICES, 0.0, FAKE_CLOUD_LATENCY, token_lifetime=TOKEN_EXPIRY_MARGIN / 2)
+
+        start = time.time()
+        s = fake_spark_interface(server)
+        print "no cache:            %.3f s, %d requests, token %s" % \
+            (time.time() - start, server.requests, s.access_token[len("?access_token="):])
+        auth_filename = s.cache_filename[:-len(".cache")]
+
+        def timed_start(name):
+            start = time.time()
+            s = fake_spark_interface(server, auth_filename)
+            elapsed = time.time() - start
+            s.bootstrap_thread.join()
+            print "%-20s %.3f s, %d devices" % (name + ":", elapsed, len(s.get_device_names()))
+            return s
+
+        timed_start("cache")
+
+        # A stale device list is used while the bootstrap thread fetches it again
+        f = open(s.cache_filename)
+        cache = json.load(f)
+        f.close()
+        cache['devices_expire_at'] = 0.0
+        f = open(s.cache_filename, 'w')
+        json.dump(cache, f)
+        f.close()
+        s = timed_start("stale device list")
+
+        server.stop(s)
+
+    def test_stream():
+        server = FakeParticleServer(NUM_FAKE_DEVICES, FAKE_DEVICE_DELAY)
+        s = fake_spark_interface(server, stream_events=True)
+        devices = s.get_device_names(postfix="_floor_temp")
+        requests_before = server.requests
+
+        start = time.time()
+        s.start()
+        time.sleep(STREAM_TEST_TIME)
+        values = [ s.get_cached_variable(d, "temperature") for d in devices ]
+
+        print "%d events from %d devices in %.1f s over %d request(s)" % \
+            (server.events, len(devices), time.time() - start, server.requests - requests_before)
+        for d, v in zip(devices, values):
+            print "   ", d, ":", v
+
+        start = time.time()
+        stopped = s.stop()
+        print "stop: %s in %.2f s" % (stopped, time.time() - start)
+        server.stop(s)
+
+        if None in values:
+            print "FAILED: no value from some of the devices"
+            sys.exit(1)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "concurrent":
+        benchmark_concurrent()
+
+    elif len(sys.argv) > 1 and sys.argv[1] == "session":
+        benchmark_session()
+
+    elif len(sys.argv) > 1 and sys.argv[1] == "startup":
+        benchmark_startup()
+
+    elif len(sys.argv) > 1 and sys.argv[1] == "stream":
+        test_stream()
+
+    else:
+        s = SparkInterface("data/spark_auth.txt")
+        devNames = s.get_device_names(postfix="_floor_temp")
+        temps = s.get_variables([ (d, "temperature") for d in devNames ])
+        for d, t in zip(devNames, temps):
+            print d, ":", t
+
+        print "Security status:", s.get_variable("security", "state")
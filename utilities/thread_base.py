@@ -2,10 +2,12 @@
 
 import sys
 import traceback
-import time
 import logging
 from plugin import Plugin
-from threading import Thread, Lock
+from threading import Thread, Lock, Event, current_thread
+
+# Default spread of the start times of periodic runs, in seconds
+DEFAULT_JITTER = 1.0
 
 
 class ThreadedPlugin(Thread, Plugin):
@@ -22,15 +24,63 @@ class ThreadedPlugin(Thread, Plugin):
         self._running     = False
         self.logger       = logging.getLogger('allspark.' + plugin_name)
         self.daemon       = True  # thread dies with program
+        
+        # Set once by signal_stop(), wait() returns early when it is set
+        self._stop_event  = Event()
+        
+        # Periodic plugins wait on this between runs, set by the scheduler or by stop()
+        self._wakeup      = Event()
+        self._period      = None
+        self._jitter      = 0.0
+        self._job         = None
 
     def is_running(self):
         return self._running
 
     def stop(self):
+        self.signal_stop()
+        self.join_stop()
+    
+    def signal_stop(self):
+        """
+        Tell the thread to stop without waiting for it, see join_stop
+        """
         if self.is_initialized() and self.is_running():
             self.logger.info( "Stopping thread" )
             self._running = False     # Signal thread to stop
-            self._run_lock.acquire()  # Wait for thread to stop
+            self._stop_event.set()
+            self._wakeup.set()
+    
+    def join_stop(self, timeout=None):
+        """
+        Wait up to timeout seconds (forever by default) for the thread to finish
+        after signal_stop, returns False if it is still running
+        """
+        if self.is_alive() and self is not current_thread():
+            self.join(timeout)
+        return not self.is_alive()
+    
+    def wait(self, seconds):
+        """
+        Sleep for up to seconds, returns True as soon as the plugin is told to stop
+        """
+        return self._stop_event.wait(seconds)
+    
+    def set_period(self, period, jitter=DEFAULT_JITTER):
+        """
+        Run private_run every period seconds on the object group scheduler,
+        instead of private_run sleeping until its next run
+        """
+        self._period = period
+        self._jitter = jitter
+    
+    def wait_for_next_run(self):
+        if self._job is not None:
+            self._wakeup.wait()
+        else:
+            # No scheduler (running stand-alone), time the runs here
+            self._wakeup.wait(self._period)
+        self._wakeup.clear()
     
     def private_run(self):
         self.logger.warning("private_run function not overridden!")
@@ -51,6 +101,11 @@ class ThreadedPlugin(Thread, Plugin):
         # MAIN LOOP #
         #############
         self._running = self._run_lock.acquire()
+        
+        scheduler = getattr(self.og, "scheduler", None)
+        if self._period is not None and scheduler is not None:
+            self._job = scheduler.schedule_periodic(self._period, self._wakeup.set, self._jitter)
+        
         while self._running:
             
             try:
@@ -58,7 +113,14 @@ class ThreadedPlugin(Thread, Plugin):
             except Exception as e:
                 tb = "".join( traceback.format_tb(sys.exc_info()[2]) )
                 self.logger.error( "exception occured in " + self.name + " thread: \n" + tb + "\n" + str( e ) )
-                time.sleep(5)
+                self.wait(5)
+            
+            if self._period is not None and self._running:
+                self.wait_for_next_run()
+        
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
         
         self.private_run_cleanup()
         
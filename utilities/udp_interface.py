@@ -7,9 +7,12 @@ import Queue
 
 
 class UDPSocket(ThreadedPlugin):
-    def __init__(self, address, rx_port, tx_port, thread_name = "udp_interface"):
+    def __init__(self, address, rx_port, tx_port, thread_name = "udp_interface", event_loop = None):
         ThreadedPlugin.__init__(self, plugin_name=thread_name)
 
+        # With an event loop the socket is read by the loop instead of a thread of its own
+        self.event_loop = event_loop
+
         self.address = address
         if self.address is None:
             self.logger.error("Address is None")
@@ -74,6 +77,28 @@ class UDPSocket(ThreadedPlugin):
                 pass
         return None
     
+    def start(self):
+        if self.event_loop is None:
+            ThreadedPlugin.start(self)
+        elif self.is_initialized() and not self.is_running():
+            self._running = True
+            self.event_loop.add_reader(self.sock, self.receive)
+    
+    def stop(self):
+        if self.event_loop is None:
+            ThreadedPlugin.stop(self)
+        elif self.is_initialized() and self.is_running():
+            self._running = False
+            self.event_loop.remove_reader(self.sock)
+            self.event_loop.call_soon(self.private_run_cleanup)
+    
+    def interrupt(self):
+        """
+        Make a get() that is waiting for a message return None now
+        """
+        if self.is_initialized():
+            self.messages.put(None)
+    
     def send_message(self, message):
         self.logger.debug( "sending message: " + message )
         self.sock.sendto(message.encode('utf-8'), (self.address, self.tx_port))
@@ -83,9 +108,12 @@ class UDPSocket(ThreadedPlugin):
         ready = select.select([self.sock], [], [], 1)  # 1 second timeout
     
         if ready[0]:
-            data, sender_addr = self.sock.recvfrom(4096)
-            self.messages.put( (sender_addr, data) )
-            self.logger.debug( "Got message: " + data )
+            self.receive()
+    
+    def receive(self):
+        data, sender_addr = self.sock.recvfrom(4096)
+        self.messages.put( (sender_addr, data) )
+        self.logger.debug( "Got message: " + data )
     
     def private_run_cleanup(self):
         # Unregister multicast receive membership, then close the port
@@ -0,0 +1,463 @@
+#! /usr/bin/env python
+
+import sys
+import json
+import time
+import Queue
+import struct
+import socket
+import hashlib
+import logging
+import urlparse
+import itertools
+import email.utils
+from threading import Thread, Lock
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger('allspark.web_server')
+
+# Rows per chunk of a streamed data response
+ROWS_PER_CHUNK = 500
+
+# Events waiting for a slow /events client before it is dropped
+MAX_CLIENT_EVENTS = 100
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Dispatches each request to the handler registered for its path, handlers are
+    called as handler(request, params) with the query parameters as a dictionary
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    # Buffer the headers and body of a response into as few packets as possible,
+    # the buffer is flushed after each request
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_response(self, code, message=None):
+        self.response_started = True
+        BaseHTTPRequestHandler.send_response(self, code, message)
+
+    def dispatch(self):
+        self.response_started = False
+        url = urlparse.urlparse(self.path)
+
+        params = {}
+        for (key, values) in urlparse.parse_qs(url.query).items():
+            params[key] = values[-1]
+
+        length = int(self.headers.getheader("Content-Length", 0))
+        if length > 0:
+            for (key, values) in urlparse.parse_qs(self.rfile.read(length)).items():
+                params[key] = values[-1]
+
+        handler = self.server.handlers.get(url.path)
+        if handler is None:
+            self.send_json(404, {"error": "not found: " + url.path})
+            return
+
+        try:
+            handler(self, params)
+        except (socket.error, IOError):
+            logger.debug( "Client went away: " + repr(sys.exc_info()[1]) )
+        except Exception:
+            logger.error( "Error handling " + self.path + ": " + repr(sys.exc_info()[1]) )
+            if self.response_started:
+                # Part of the response is already out, all the client can be told is that it ended early
+                self.close_connection = True
+            else:
+                self.send_json(500, {"error": "internal error"})
+
+    def send_json(self, code, obj):
+        content = json.dumps(obj)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(content)
+
+    def start_chunked(self, content_type, headers=None):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        for (key, value) in (headers or []):
+            self.send_header(key, value)
+        self.end_headers()
+
+    def write_chunk(self, content):
+        if len(content) > 0:
+            self.wfile.write("%x\r\n%s\r\n" % (len(content), content))
+
+    def end_chunked(self):
+        self.wfile.write("0\r\n\r\n")
+
+    def log_message(self, format_str, *args):
+        logger.debug( "%s %s" % (self.address_string(), format_str % args) )
+
+
+class EventPublisher:
+    """
+    Server-sent events for the open pages at /events. Plugins publish
+    "update" events of {element id: new value} and the page patches those
+    elements. The latest value of every element is kept and sent to each page
+    when it connects, so it starts up to date.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.clients = []
+        self.latest = {}
+
+    def publish(self, updates):
+        self.lock.acquire()
+        try:
+            self.latest.update(updates)
+            self.send( "event: update\ndata: %s\n\n" % json.dumps(updates) )
+        finally:
+            self.lock.release()
+
+    def keepalive(self):
+        """
+        Keeps idle connections from being closed by proxies, called periodically
+        """
+        self.lock.acquire()
+        try:
+            self.send( ": keepalive\n\n" )
+        finally:
+            self.lock.release()
+
+    def send(self, message):
+        for client in list(self.clients):
+            try:
+                client.put_nowait(message)
+            except Queue.Full:
+                logger.warning( "Dropping a client that is not reading events" )
+                self.clients.remove(client)
+                self.close_client(client)
+
+    @staticmethod
+    def close_client(client):
+        # Make room for the end marker, the client is going away anyway
+        try:
+            while True:
+                client.get_nowait()
+        except Queue.Empty:
+            pass
+        client.put_nowait(None)
+
+    def close(self):
+        self.lock.acquire()
+        for client in self.clients:
+            self.close_client(client)
+        self.clients = []
+        self.lock.release()
+
+    def handle_events(self, request, params):
+        client = Queue.Queue(MAX_CLIENT_EVENTS)
+
+        self.lock.acquire()
+        if len(self.latest) > 0:
+            client.put_nowait( "event: update\ndata: %s\n\n" % json.dumps(self.latest) )
+        self.clients.append(client)
+        self.lock.release()
+
+        request.send_response(200)
+        request.send_header("Content-Type", "text/event-stream")
+        request.send_header("Cache-Control", "no-cache")
+        request.send_header("Access-Control-Allow-Origin", "*")
+        request.send_header("Connection", "close")
+        request.end_headers()
+        request.close_connection = True
+
+        try:
+            while True:
+                message = client.get()
+                if message is None:
+                    break
+                request.wfile.write(message)
+                request.wfile.flush()
+        finally:
+            self.lock.acquire()
+            if client in self.clients:
+                self.clients.remove(client)
+            self.lock.release()
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class WebServer(Thread):
+    """
+    HTTP server inside the daemon. Serves the data of the registered loggers
+    at /data and live updates at /events, other services add their own paths
+    with register_handler.
+    """
+
+    def __init__(self, port):
+        Thread.__init__(self, name="web_server")
+        self._initialized = False
+        self.daemon = True
+        self.port = port
+
+        self.data_loggers = {}
+        self.events = EventPublisher()
+
+        try:
+            self.server = ThreadedHTTPServer(("", self.port), RequestHandler)
+        except socket.error:
+            logger.error( "Failed to start web server: " + repr(sys.exc_info()[1]) )
+            return
+
+        self.server.handlers = {"/data": self.handle_data,
+                                "/events": self.events.handle_events}
+
+        self._initialized = True
+
+    def is_initialized(self):
+        return self._initialized
+
+    def register_handler(self, path, func):
+        if self._initialized:
+            self.server.handlers[path] = func
+
+    def register_data_logger(self, data_logger):
+        """
+        Serve a logger at /data?logger=<archive prefix>
+        """
+        self.data_loggers[data_logger.archive_prefix] = data_logger
+
+    def run(self):
+        logger.info( "Thread started, port: " + str(self.port) )
+        self.server.serve_forever()
+        logger.info( "Thread stopped" )
+
+    def stop(self):
+        if self._initialized and self.is_alive():
+            self.events.close()
+            self.server.shutdown()
+            self.server.server_close()
+            self.join()
+
+    def handle_data(self, request, params):
+        """
+        /data?logger=<name>[&start=<time>][&end=<time>][&points=<n>][&format=json|binary]
+
+        Rows of a logger between start (default: midnight) and end (default: now)
+        as JSON {"columns": [...], "rows": [[time, value, ...], ...]}, or as
+        little-endian float64 records of time and values. When the range needs more
+        than points rows the means of a rollup tier are sent instead.
+        """
+        data_logger = self.data_loggers.get(params.get("logger"))
+        if data_logger is None:
+            request.send_json(404, {"error": "unknown logger: " + str(params.get("logger"))})
+            return
+
+        try:
+            now = time.time()
+            start = float(params.get("start", time.mktime(time.localtime(now)[:3] + (0, 0, 0, 0, 0, -1))))
+            end = float(params.get("end", now))
+            points = int(params["points"]) if "points" in params else None
+        except ValueError:
+            request.send_json(400, {"error": "bad start, end or points"})
+            return
+
+        data_format = params.get("format", "json")
+        if data_format not in ["json", "binary"]:
+            request.send_json(400, {"error": "bad format: " + data_format})
+            return
+
+        # The response only changes while new samples can land inside the range,
+        # there is no modification time before the first sample of the day
+        today = data_logger.get_data_set()
+        last_modified = None
+        if today is not None and len(today) > 0:
+            last_modified = int(min(end, today[-1]['time']))
+
+        # The same range is served from a rollup tier once the tiers are backfilled
+        tier = None
+        if hasattr(data_logger, "select_tier"):
+            tier = data_logger.select_tier(end - start, points)
+        tier_name = tier.name if tier is not None else "raw"
+
+        etag = '"%s"' % hashlib.md5("|".join([ data_logger.archive_prefix, data_format, str(points),
+                                               repr(start), str(last_modified), tier_name ])).hexdigest()
+
+        if_none_match = request.headers.getheader("If-None-Match")
+        if if_none_match is not None:
+            not_modified = if_none_match == etag
+        else:
+            not_modified = last_modified is not None and \
+                self.not_modified_since(request.headers.getheader("If-Modified-Since"), last_modified)
+
+        if not_modified:
+            request.send_response(304)
+            request.send_header("ETag", etag)
+            request.send_header("Access-Control-Allow-Origin", "*")
+            request.send_header("Content-Length", "0")
+            request.end_headers()
+            return
+
+        columns = data_logger.get_column_names()
+        if tier is None:
+            rows = data_logger.iter_query(start, end)
+        else:
+            # Only the means of the rollup rows
+            rows = ( (t, data[:len(columns)]) for (t, data) in data_logger.query_rollup(tier, start, end) )
+
+        headers = [("ETag", etag), ("Cache-Control", "no-cache")]
+        if last_modified is not None:
+            headers.append( ("Last-Modified", email.utils.formatdate(last_modified, usegmt=True)) )
+
+        if data_format == "binary":
+            record_format = "<%dd" % (len(columns) + 1)
+            request.start_chunked("application/octet-stream", headers)
+            for chunk in self.chunks(rows):
+                request.write_chunk( "".join([ struct.pack(record_format, t, *self.to_floats(data, len(columns)))
+                                               for (t, data) in chunk ]) )
+            request.end_chunked()
+            return
+
+        request.start_chunked("application/json", headers)
+        request.write_chunk( '{"logger": %s, "tier": %s, "columns": %s, "rows": [' %
+                             ( json.dumps(data_logger.archive_prefix),
+                               json.dumps(tier.name if tier is not None else None),
+                               json.dumps(columns) ) )
+        separator = ""
+        for chunk in self.chunks(rows):
+            request.write_chunk( separator + ",".join([ json.dumps([t] + self.to_values(data)) for (t, data) in chunk ]) )
+            separator = ","
+        request.write_chunk("]}")
+        request.end_chunked()
+
+    @staticmethod
+    def chunks(rows):
+        """
+        Lists of up to ROWS_PER_CHUNK rows from any iterable of rows
+        """
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, ROWS_PER_CHUNK))
+            if len(chunk) == 0:
+                return
+            yield chunk
+
+    @staticmethod
+    def not_modified_since(header, last_modified):
+        if header is None:
+            return False
+        parsed = email.utils.parsedate_tz(header)
+        if parsed is None:
+            return False
+        return last_modified <= email.utils.mktime_tz(parsed)
+
+    @staticmethod
+    def to_values(data):
+        """
+        Stored items as numbers where they are numbers, "null" as None
+        """
+        values = []
+        for item in data:
+            try:
+                value = float(item)
+                values.append(value if value == value else None)
+            except (ValueError, TypeError):
+                values.append(None if item == "null" else item)
+        return values
+
+    @staticmethod
+    def to_floats(data, num_columns):
+        values = []
+        for item in list(data[:num_columns]) + [None] * (num_columns - len(data)):
+            try:
+                values.append(float(item))
+            except (ValueError, TypeError):
+                values.append(float('nan'))
+        return values
+
+
+#
+# MAIN
+#
+if __name__ == "__main__":
+    import httplib
+    import urllib2
+
+    class TestLogger:
+        archive_prefix = "test"
+        today = [ {'time': 1000.0, 'data': ["1.0", "null"]} ]
+
+        def get_column_names(self):
+            return ["a", "b"]
+
+        def get_data_set(self):
+            return self.today
+
+        def iter_query(self, start, end):
+            for t in range(int(start), int(min(end, 1000.0)) + 1):
+                yield (t, ["%.1f" % t, "null"])
+
+    class EmptyDayLogger(TestLogger):
+        # Just after midnight, before the first sample of the day
+        archive_prefix = "empty"
+        today = []
+
+    class BrokenLogger(TestLogger):
+        # Fails after the headers and the first chunks are out
+        archive_prefix = "broken"
+
+        def iter_query(self, start, end):
+            for row in TestLogger.iter_query(self, start, end):
+                yield row
+            raise IOError("disk error")
+
+    web = WebServer(8080)
+
+    if not web.is_initialized():
+        print "Failed to initialize"
+
+    else:
+        for data_logger in [TestLogger(), EmptyDayLogger(), BrokenLogger()]:
+            web.register_data_logger(data_logger)
+        web.start()
+
+        response = urllib2.urlopen("http://localhost:8080/data?logger=test&start=0&end=2000")
+        print response.info().getheader("ETag"), len(json.loads(response.read())["rows"]), "rows"
+
+        try:
+            urllib2.urlopen(urllib2.Request("http://localhost:8080/data?logger=test&start=0&end=2000",
+                                            headers={"If-None-Match": response.info().getheader("ETag")}))
+        except urllib2.HTTPError as e:
+            print "Repeat request:", e.code
+
+        # Yesterday's copy must not be reused before today has any data
+        response = urllib2.urlopen(urllib2.Request("http://localhost:8080/data?logger=empty",
+                                                   headers={"If-Modified-Since": email.utils.formatdate(usegmt=True)}))
+        print "Empty day with If-Modified-Since:", response.getcode()
+
+        try:
+            urllib2.urlopen("http://localhost:8080/data?logger=broken&start=0&end=2000").read()
+            print "Failure after the headers: FAILED, the response looked complete"
+        except httplib.IncompleteRead:
+            print "Failure after the headers: connection closed, response incomplete"
+
+        web.stop()